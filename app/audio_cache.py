@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+
+class AudioCache:
+    """
+    Content-addressed cache ของไฟล์เสียงที่สังเคราะห์แล้ว (TTS)
+
+    ไฟล์เสียงถูกเก็บในชื่อ sha256(text, speaker, engine).wav ภายใน directory
+    พร้อมไฟล์ .json ที่เก็บความยาวเสียง (ms) ไว้ข้างกัน ข้อความเดิมจึงไม่ต้องสังเคราะห์ใหม่
+    และผู้ใช้แต่ละคนได้ URL ของไฟล์ตัวเอง เมื่อขนาดรวมเกิน max_bytes จะลบไฟล์ที่ไม่ได้ใช้นานที่สุดก่อน
+    ขนาดรวมและลำดับการใช้งานเก็บไว้ใน memory จึงสแกน directory เฉพาะตอนเริ่มและเมื่อขนาดเกิน max_bytes
+    """
+
+    def __init__(self, directory, max_bytes=200 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # key -> bytes, least recently used first
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with self._lock:
+            self._scan()
+
+    @staticmethod
+    def key(text, speaker, engine):
+        raw = json.dumps([text, speaker, engine], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def filename(self, key):
+        return key + ".wav"
+
+    def path(self, key):
+        return os.path.join(self.directory, self.filename(key))
+
+    def temp_path(self, key):
+        """Path to synthesize into before store() moves it in place"""
+        return os.path.join(self.directory, f"{key}.{uuid.uuid4().hex}.tmp")
+
+    def lookup(self, key, count_miss=True):
+        """
+        Return the duration (ms) of a cached file, or None on a miss
+
+        count_miss=False is for a check ahead of the synthesis path, which looks up (and counts) again.
+        """
+        try:
+            with open(self._meta_path(key), "r") as f:
+                duration_ms = json.load(f)["duration_ms"]
+            os.utime(self.path(key))  # mark as recently used for eviction
+        except (OSError, ValueError, KeyError):
+            if count_miss:
+                with self._lock:
+                    self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            if key in self._index:
+                self._index.move_to_end(key)
+        return duration_ms
+
+    def store(self, key, temp_path, duration_ms):
+        """Move a freshly synthesized file into the cache and record its duration"""
+        os.replace(temp_path, self.path(key))
+        meta_tmp = self._meta_path(key) + ".tmp"
+        with open(meta_tmp, "w") as f:
+            json.dump({"duration_ms": duration_ms}, f)
+        os.replace(meta_tmp, self._meta_path(key))
+        size = os.path.getsize(self.path(key))
+        with self._lock:
+            self._total += size - self._index.pop(key, 0)
+            self._index[key] = size
+            over = self._total > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used files until the directory is under max_bytes"""
+        with self._lock:
+            # Other worker processes may share the directory: count it again before deleting
+            self._scan()
+            while self._total > self.max_bytes and self._index:
+                key, size = self._index.popitem(last=False)
+                for path in (self.path(key), self._meta_path(key)):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                self._total -= size
+
+    def _scan(self):
+        # Called with self._lock held; the file times give the order of use (lookup() touches them)
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".wav"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.name[:-4]))
+        files.sort()
+        self._index = OrderedDict((key, size) for _, size, key in files)
+        self._total = sum(size for _, size, _ in files)
+
+    def discard(self, temp_path):
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+    def _meta_path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "backend": "files",
+            "directory": self.directory,
+            "max_bytes": self.max_bytes,
+            "bytes": self._total,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,233 @@
+import io
+import math
+import operator
+import time
+import wave
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from app import metrics
+
+SAMPLE_RATE = 16000
+FRAME_MS = 20
+# A cut is searched for within this many seconds around each evenly spaced cut position
+SEARCH_SECONDS = 3.0
+# Frames quieter than max(MIN_SILENCE_RMS, SILENCE_FACTOR * noise floor) count as silence (int16 RMS)
+MIN_SILENCE_RMS = 200
+SILENCE_FACTOR = 2.0
+
+segment_seconds = metrics.Histogram("stt_segment_seconds", "Latency of transcribing one audio segment")
+segments_total = metrics.Counter("stt_segments_total", "Audio segments transcribed, by result", ["result"])
+
+
+######### Decoding to 16 kHz mono PCM #####
+def decode_pcm(data):
+    """
+    Decode audio bytes (LINE sends m4a/AAC) to 16 kHz mono signed 16-bit PCM, or None
+
+    PyAV (pip install av) decodes every container LINE uses; without it only WAV can be decoded.
+    """
+    try:
+        import av  # noqa: F401
+    except ImportError:
+        return _decode_wav(data)
+    try:
+        return _decode_av(data)
+    except Exception as e:
+        print(f"[audio] decoding failed: {type(e).__name__}: {e}")
+        return None
+
+
+def _decode_av(data):
+    import av
+
+    pcm = bytearray()
+    with av.open(io.BytesIO(data)) as container:
+        stream = container.streams.audio[0]
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=SAMPLE_RATE)
+        for frame in container.decode(stream):
+            for out in resampler.resample(frame):
+                pcm += bytes(out.planes[0])[: out.samples * 2]
+        for out in resampler.resample(None):
+            pcm += bytes(out.planes[0])[: out.samples * 2]
+    return bytes(pcm)
+
+
+def _decode_wav(data):
+    if data[:4] != b"RIFF":
+        return None
+    try:
+        with wave.open(io.BytesIO(data), "rb") as f:
+            channels, width, rate = f.getnchannels(), f.getsampwidth(), f.getframerate()
+            frames = f.readframes(f.getnframes())
+    except (wave.Error, EOFError):
+        return None
+    if width != 2:
+        return None
+    samples = array("h", frames)
+    if channels > 1:
+        samples = array("h", (sum(samples[i:i + channels]) // channels for i in range(0, len(samples), channels)))
+    if rate != SAMPLE_RATE:
+        samples = _resample(samples, rate, SAMPLE_RATE)
+    return samples.tobytes()
+
+
+def _resample(samples, rate, target):
+    """Linear interpolation resampling (used without PyAV only)"""
+    count = int(len(samples) * target / rate)
+    step = rate / target
+    last = len(samples) - 1
+    out = array("h", bytes(2 * count))
+    for i in range(count):
+        position = i * step
+        j = int(position)
+        if j >= last:
+            out[i] = samples[last]
+        else:
+            fraction = position - j
+            out[i] = int(samples[j] + (samples[j + 1] - samples[j]) * fraction)
+    return out
+
+
+def to_wav(pcm):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(pcm)
+    return buffer.getvalue()
+
+
+######### Splitting at silence #####
+def frame_rms(samples, frame_samples):
+    rms = []
+    for start in range(0, len(samples), frame_samples):
+        frame = samples[start:start + frame_samples]
+        rms.append(math.sqrt(sum(map(operator.mul, frame, frame)) / len(frame)))
+    return rms
+
+
+def split_points(pcm, target_seconds, min_silence_ms=250):
+    """
+    Sample offsets at which to cut pcm into segments of about target_seconds
+
+    Cuts are spread evenly so that the segments take about the same time to transcribe,
+    and each is moved to the middle of the nearest silence (at least min_silence_ms long)
+    within SEARCH_SECONDS, or to the quietest frame there when no silence is found.
+    """
+    samples = array("h", pcm)
+    duration = len(samples) / SAMPLE_RATE
+    count = math.ceil(duration / target_seconds) if target_seconds > 0 else 1
+    if count <= 1:
+        return []
+
+    frame_samples = SAMPLE_RATE * FRAME_MS // 1000
+    rms = frame_rms(samples, frame_samples)
+    noise_floor = sorted(rms)[len(rms) // 10]
+    threshold = max(MIN_SILENCE_RMS, SILENCE_FACTOR * noise_floor)
+    min_run = max(1, min_silence_ms // FRAME_MS)
+
+    # Middle frame of every run of silent frames that is long enough
+    silences = []
+    run_start = None
+    for i, value in enumerate(rms + [threshold]):
+        if value < threshold:
+            if run_start is None:
+                run_start = i
+        elif run_start is not None:
+            if i - run_start >= min_run:
+                silences.append((run_start + i) // 2)
+            run_start = None
+
+    search = int(SEARCH_SECONDS * 1000 / FRAME_MS)
+    points = []
+    previous = 0
+    for k in range(1, count):
+        ideal = round(k * len(rms) / count)
+        low, high = max(previous + 1, ideal - search), min(len(rms) - 1, ideal + search)
+        if low >= high:
+            continue
+        nearby = [frame for frame in silences if low <= frame <= high]
+        if nearby:
+            cut = min(nearby, key=lambda frame: abs(frame - ideal))
+        else:
+            cut = min(range(low, high), key=lambda frame: rms[frame])
+        points.append(cut * frame_samples)
+        previous = cut
+    return points
+
+
+def is_silent(pcm):
+    samples = array("h", pcm)
+    return not samples or max(map(abs, samples)) < MIN_SILENCE_RMS
+
+
+class SegmentedTranscriber:
+    """
+    แปลงเสียงเป็นข้อความแบบแบ่งช่วง: ถอดรหัสเป็น PCM 16 kHz mono, ตัดเสียงยาวที่ช่วงเงียบ
+    ออกเป็นท่อนละประมาณ segment_seconds และส่งแต่ละท่อนให้ transcribe_segment พร้อมกันไม่เกิน max_parallel
+    แล้วนำข้อความมาต่อกันตามลำดับ เสียงยาว 60 วินาทีจึงใช้เวลาใกล้เคียงกับท่อนสั้น ๆ ท่อนเดียว
+
+    transcribe_segment(wav_bytes, filename) returns the text of one WAV segment.
+    Audio that cannot be decoded is sent as is in a single call.
+    """
+
+    def __init__(self, transcribe_segment, segment_seconds=15.0, max_parallel=4, min_silence_ms=250):
+        self.transcribe_segment = transcribe_segment
+        self.segment_seconds = segment_seconds
+        self.min_silence_ms = min_silence_ms
+        self._executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="stt")
+
+    def transcribe(self, data):
+        """Return (text, timings); timings has one {"index", "start", "end", "seconds", "ok"} per segment"""
+        pcm = decode_pcm(data)
+        if pcm is None:
+            start = time.perf_counter()
+            text = self.transcribe_segment(data, "received_audio.wav")
+            return text, [{"index": 0, "start": None, "end": None, "seconds": time.perf_counter() - start, "ok": True}]
+
+        bounds = [0] + split_points(pcm, self.segment_seconds, self.min_silence_ms) + [len(pcm) // 2]
+        segments = [
+            (index, start, end)
+            for index, (start, end) in enumerate(zip(bounds, bounds[1:]))
+            if not is_silent(pcm[start * 2:end * 2])
+        ]
+        if not segments:
+            return "", []
+        futures = [
+            self._executor.submit(self._run_segment, index, start, end, pcm[start * 2:end * 2])
+            for index, start, end in segments
+        ]
+        results = [future.result() for future in futures]
+
+        timings = [timing for _, timing, _ in results]
+        errors = [error for _, _, error in results if error is not None]
+        if len(errors) == len(results):
+            raise errors[0]
+        text = " ".join("[…]" if error is not None else str(part).strip() for part, _, error in results)
+        print(
+            f"[audio] {len(pcm) / 2 / SAMPLE_RATE:.1f}s in {len(segments)} segments: "
+            + ", ".join(f"#{t['index']} {t['end'] - t['start']:.1f}s->{t['seconds']:.2f}s" for t in timings)
+        )
+        return text, timings
+
+    def _run_segment(self, index, start, end, pcm):
+        began = time.perf_counter()
+        error = None
+        text = ""
+        try:
+            text = self.transcribe_segment(to_wav(pcm), f"segment{index}.wav")
+        except Exception as e:
+            error = e
+        seconds = time.perf_counter() - began
+        segment_seconds.observe(seconds)
+        segments_total.inc(result="error" if error is not None else "ok")
+        timing = {
+            "index": index,
+            "start": start / SAMPLE_RATE,
+            "end": end / SAMPLE_RATE,
+            "seconds": seconds,
+            "ok": error is None,
+        }
+        return text, timing, error
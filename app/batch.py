@@ -0,0 +1,97 @@
+import asyncio
+import json
+from collections import deque
+
+from fastapi.concurrency import run_in_threadpool
+
+
+class BatchRunner:
+    """
+    รันคำสั่ง NLP หลายรายการพร้อมกันผ่าน CommandRegistry เดียวกับ webhook
+
+    concurrency        : จำนวนรายการที่รันพร้อมกันทั้งหมด
+    engine_concurrency : จำนวนรายการที่รันพร้อมกันต่อคำสั่ง (engine)
+    ผลลัพธ์ถูกส่งออกตามลำดับของ input ทันทีที่รายการหัวแถวเสร็จ
+    """
+
+    def __init__(self, registry, concurrency=16, engine_concurrency=4):
+        self.registry = registry
+        self.concurrency = concurrency
+        self.engine_concurrency = engine_concurrency
+        self._semaphore = None
+        self._engine_semaphores = {}
+
+    async def run(self, items):
+        """Async generator of one result dict per item of the (async) iterable items, in input order"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        # Bound the number of items read ahead so huge NDJSON inputs are not held in memory
+        window = self.concurrency * 4
+        pending = deque()
+        index = 0
+        async for item in _aiter(items):
+            pending.append(asyncio.ensure_future(self._run_item(index, item)))
+            index += 1
+            while pending and (len(pending) >= window or pending[0].done()):
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+
+    async def _run_item(self, index, item):
+        if not isinstance(item, dict):
+            return {"index": index, "error": "Each item must be an object with command and text"}
+        name = str(item.get("command", "")).strip()
+        text = str(item.get("text", ""))
+        matched = self.registry.match(name)
+        if matched is None or matched[2]:
+            return {"index": index, "command": name, "error": "Service not found"}
+        command, model, _ = matched
+
+        engine_semaphore = self._engine_semaphores.get(command.name)
+        if engine_semaphore is None:
+            engine_semaphore = self._engine_semaphores[command.name] = asyncio.Semaphore(
+                self.engine_concurrency
+            )
+        # The engine slot first: items waiting for a busy engine must not hold global slots
+        # that items of the other engines could use
+        async with engine_semaphore, self._semaphore:
+            try:
+                result = await run_in_threadpool(self.registry.run, command, model, text.strip())
+            except Exception as e:
+                return {"index": index, "command": name, "error": f"{type(e).__name__}: {e}"}
+
+        if result is not None and not isinstance(result, str):
+            result = result.as_json_dict()  # e.g. AudioSendMessage of #tts
+        return {"index": index, "command": name, "result": result}
+
+
+async def _aiter(items):
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+def read_ndjson(body):
+    """
+    Parse NDJSON bytes, one object per non-empty line (None for lines that are not JSON)
+
+    The request body is read before the response starts: StreamingResponse listens on
+    the same receive channel for disconnects, so the body cannot be streamed while replying.
+    """
+    for line in body.split(b"\n"):
+        if line.strip():
+            yield _loads(line)
+
+
+def _loads(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def to_ndjson(result):
+    return json.dumps(result, ensure_ascii=False) + "\n"
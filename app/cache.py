@@ -0,0 +1,246 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from app import metrics
+
+# All caches created by the services, keyed by name (used by /stats)
+caches = {}
+
+
+def make_key(*parts):
+    """Join key parts into a single string key (None becomes an empty part)"""
+    return "\x1f".join("" if part is None else str(part) for part in parts)
+
+
+def normalize_text(text):
+    """Collapse whitespace so that "a  b" and " a b " share one cache entry"""
+    return " ".join(text.split())
+
+
+class MemoryCache:
+    """
+    In-process LRU cache with per-entry TTL
+
+    เก็บผลลัพธ์ไว้ในหน่วยความจำ จำกัดจำนวนรายการด้วย max_entries (ลบรายการที่ใช้ล่าสุดนานที่สุดก่อน)
+    และแต่ละรายการหมดอายุตาม ttl (วินาที, None = ไม่หมดอายุ)
+    """
+
+    def __init__(self, max_entries=1024, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def add(self, key, value, ttl=None):
+        """Set key only when it is absent (or expired); True when the value was stored"""
+        ttl = self.ttl if ttl is None else ttl
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and (item[1] is None or item[1] > now):
+                return False
+            self._data[key] = (value, now + ttl if ttl else None)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "size": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class SQLiteCache:
+    """
+    On-disk cache backed by SQLite (WAL mode) that survives restarts
+
+    มี interface เดียวกับ MemoryCache ค่าที่เก็บต้องแปลงเป็น JSON ได้
+    ใช้ไฟล์เดียวกันได้จากหลาย process บนเครื่องเดียวกัน
+    """
+
+    # Trim to max_entries only every N writes to keep set() cheap
+    TRIM_EVERY = 64
+
+    def __init__(self, path, max_entries=10000, ttl=None, table="cache"):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.table = table
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed_at)"
+        )
+        self._conn.commit()
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and (row[1] is None or row[1] > now):
+                self._conn.execute(
+                    f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key)
+                )
+                self._conn.commit()
+                self.hits += 1
+                return json.loads(row[0])
+            if row is not None:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._conn.commit()
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at, now),
+            )
+            self._writes += 1
+            if self._writes % self.TRIM_EVERY == 0:
+                self._trim(now)
+            self._conn.commit()
+
+    def add(self, key, value, ttl=None):
+        """Set key only when it is absent (or expired); True when the value was stored"""
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._lock:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+                (key, now),
+            )
+            cursor = self._conn.execute(
+                f"INSERT OR IGNORE INTO {self.table} (key, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at, now),
+            )
+            added = cursor.rowcount == 1
+            if added:
+                self._writes += 1
+                if self._writes % self.TRIM_EVERY == 0:
+                    self._trim(now)
+            self._conn.commit()
+            return added
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def _trim(self, now):
+        self._conn.execute(
+            f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at <= ?",
+            (now,),
+        )
+        self._conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} "
+            "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "backend": "sqlite",
+            "size": len(self),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def create_cache(name, backend="memory", path=None, max_entries=1024, ttl=None):
+    """Create a cache ("memory" or "sqlite") and register it under name"""
+    if backend == "sqlite":
+        cache = SQLiteCache(path, max_entries=max_entries, ttl=ttl, table=name)
+    elif backend == "memory":
+        cache = MemoryCache(max_entries=max_entries, ttl=ttl)
+    else:
+        raise ValueError(f"Unknown cache backend: {backend}")
+    caches[name] = cache
+    return cache
+
+
+def _counter_values(field):
+    return {(name, ): cache.stats()[field] for name, cache in caches.items()}
+
+
+cache_hits = metrics.Counter(
+    "cache_hits_total", "Cache hits since start", ["cache"], callback=lambda: _counter_values("hits")
+)
+cache_misses = metrics.Counter(
+    "cache_misses_total", "Cache misses since start", ["cache"], callback=lambda: _counter_values("misses")
+)
+
+
+def stats_all():
+    return {name: cache.stats() for name, cache in caches.items()}
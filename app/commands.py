@@ -0,0 +1,172 @@
+import threading
+from dataclasses import dataclass, field
+
+from app import metrics
+from app.cache import make_key, normalize_text
+
+
+@dataclass
+class Command:
+    """
+    A "#command" registered in a CommandRegistry
+
+    func(content, model) returns the reply: a str, a linebot SendMessage, or None for no reply.
+    upstream       : name of the upstream service for rate limits and circuit breaking (defaults to the command name)
+    default_model  : commands that accept a "_<model>" suffix (e.g. #soundex_royin) and their default
+    cache_ttl      : cache the reply for this many seconds (None = not cacheable)
+    timeout        : deadline of the upstream call in seconds (None = the upstream's policy)
+    max_concurrency: limit of concurrent calls of this command (None = unlimited)
+    local          : runs in process, so it skips the resilience layer (func calls upstreams itself if needed)
+    lookup         : func(content, model) returning the reply from a cache of the command's own (e.g. TTS audio), or None
+    """
+
+    name: str
+    func: object
+    upstream: str = None
+    default_model: str = None
+    cache_ttl: int = None
+    timeout: float = None
+    max_concurrency: int = None
+    local: bool = False
+    lookup: object = None
+    semaphore: object = field(default=None, repr=False)
+
+    @property
+    def cacheable(self):
+        return self.cache_ttl is not None
+
+
+class CommandRegistry:
+    """
+    Registry of "#command" handlers built once at import time
+
+    Commands are kept in a character trie so that matching a message is a single
+    walk over its leading characters (longest registered prefix wins), whatever
+    the number of commands. The "_<model>" suffix is parsed in the same pass.
+    Identical calls running at the same time share one upstream call through singleflight.
+    """
+
+    def __init__(self, cache=None, resilience=None, singleflight=None):
+        self.cache = cache
+        self.resilience = resilience
+        self.singleflight = singleflight
+        self._commands = {}
+        self._trie = {}
+
+    def command(
+        self,
+        name,
+        upstream=None,
+        default_model=None,
+        cache_ttl=None,
+        timeout=None,
+        max_concurrency=None,
+        local=False,
+        lookup=None,
+    ):
+        """Decorator registering func(content, model) as the handler of name"""
+
+        def decorator(func):
+            self.add(
+                Command(
+                    name=name,
+                    func=func,
+                    upstream=upstream or name,
+                    default_model=default_model,
+                    cache_ttl=cache_ttl,
+                    timeout=timeout,
+                    max_concurrency=max_concurrency,
+                    local=local,
+                    lookup=lookup,
+                )
+            )
+            return func
+
+        return decorator
+
+    def add(self, command):
+        if command.max_concurrency:
+            command.semaphore = threading.BoundedSemaphore(command.max_concurrency)
+        node = self._trie
+        for char in command.name:
+            node = node.setdefault(char, {})
+        node[None] = command
+        self._commands[command.name] = command
+
+    def get(self, name):
+        return self._commands.get(name)
+
+    def __iter__(self):
+        return iter(self._commands.values())
+
+    def __len__(self):
+        return len(self._commands)
+
+    def match(self, text):
+        """
+        Return (command, model, content) for a message, or None when no command matches
+
+        "#soundex_royin กา" -> (<#soundex>, "royin", "กา")
+        """
+        node = self._trie
+        command = None
+        end = 0
+        for i, char in enumerate(text):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                command, end = node[None], i + 1
+        if command is None:
+            return None
+
+        model = command.default_model
+        if command.default_model is not None and text[end:end + 1] == "_":
+            start = end = end + 1
+            while end < len(text) and text[end].isascii() and text[end].isalnum():
+                end += 1
+            model = text[start:end] or command.default_model
+        return command, model, text[end:].strip()
+
+    def cached(self, command, model, content):
+        """The reply of a command from the reply cache (or the command's own lookup) without running it, or None"""
+        if command.cacheable and self.cache is not None:
+            return self.cache.get(make_key(command.name, model, normalize_text(content)))
+        if command.lookup is not None:
+            return command.lookup(content, model)
+        return None
+
+    def run(self, command, model, content, check_cache=True):
+        """
+        Run a command, going through the cache, the concurrency limit and the resilience layer when configured
+
+        check_cache=False skips the reply cache lookup after a miss of cached() (the reply is still stored).
+        Only runs past the reply cache are timed, the same way whether the hit was found here or by cached().
+        """
+        key = make_key(command.name, model, normalize_text(content))
+        cached = command.cacheable and self.cache is not None
+        if cached and check_cache:
+            result = self.cache.get(key)
+            if result is not None:
+                return result
+
+        with metrics.command_seconds.time(command=command.name):
+            if self.singleflight is None:
+                return self._fill(command, model, content, key if cached else None)
+            return self.singleflight.do(key, self._fill, command, model, content, key if cached else None)
+
+    def _fill(self, command, model, content, key):
+        if command.semaphore is not None:
+            with command.semaphore:
+                result = self._call(command, model, content)
+        else:
+            result = self._call(command, model, content)
+
+        if key is not None and isinstance(result, str):
+            self.cache.set(key, result, ttl=command.cache_ttl)
+        return result
+
+    def _call(self, command, model, content):
+        if self.resilience is None or command.local:
+            return command.func(content, model)
+        return self.resilience.call(command.upstream, command.func, content, model, deadline=command.timeout)
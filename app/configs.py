@@ -13,4 +13,117 @@ class Configs(BaseSettings):
     URL_PARTII: str
     URL_VAJA: str
 
+    # Base URLs of LINE and AI FOR THAI (override to point the bot at the local stand-ins in bench/)
+    LINE_API_ENDPOINT: str = "https://api.line.me"
+    LINE_API_DATA_ENDPOINT: str = "https://api-data.line.me"
+    AIFORTHAI_BASE_URL: str = "https://api.aiforthai.in.th"
+
+    # aift modules to import in the background at startup (e.g. ["aift.multimodal.textqa"], ["all"]);
+    # the others are imported on first use
+    AIFT_WARMUP: list = []
+
+    # Webhook dispatch ("queue" = ack first and process in workers, "inline" = process before ack)
+    WEBHOOK_DISPATCH_MODE: str = "queue"
+    WEBHOOK_WORKERS: int = 4
+    WEBHOOK_QUEUE_SIZE: int = 100
+
+    # Replies: seconds a reply token stays usable, safety margin before that, push when it has expired,
+    # and LINE's loading animation for work expected to take REPLY_LOADING_THRESHOLD seconds or more
+    REPLY_TOKEN_TTL: float = 60.0
+    REPLY_DEADLINE_MARGIN: float = 5.0
+    REPLY_PUSH_FALLBACK: bool = True
+    REPLY_LOADING_ANIMATION: bool = True
+    REPLY_LOADING_THRESHOLD: float = 2.0
+
+    # Webhook event ids already accepted, to drop LINE redeliveries ("memory" or "sqlite", seconds kept)
+    WEBHOOK_DEDUP_BACKEND: str = "memory"
+    WEBHOOK_DEDUP_PATH: str = "cache/webhook_events.db"
+    WEBHOOK_DEDUP_TTL: int = 24 * 60 * 60
+    WEBHOOK_DEDUP_MAX_ENTRIES: int = 100000
+
+    # Shared HTTP client for direct AI FOR THAI calls (seconds / connections per host)
+    HTTP_CONNECT_TIMEOUT: float = 5.0
+    HTTP_READ_TIMEOUT: float = 60.0
+    HTTP_POOL_CONNECTIONS: int = 4
+    HTTP_POOL_MAXSIZE: int = 16
+
+    # Result cache for deterministic NLP commands ("memory" or "sqlite")
+    NLP_CACHE_BACKEND: str = "memory"
+    NLP_CACHE_PATH: str = "cache/nlp_results.db"
+    NLP_CACHE_SIZE: int = 5000
+
+    # Size cap of the synthesized audio kept under DIR_FILE (bytes)
+    TTS_CACHE_MAX_BYTES: int = 200 * 1024 * 1024
+
+    # Media download from LINE: read chunk size and in-memory limit before spooling to a temp file (bytes)
+    MEDIA_CHUNK_SIZE: int = 64 * 1024
+    MEDIA_SPOOL_THRESHOLD: int = 4 * 1024 * 1024
+
+    # Voice messages: decoded to 16 kHz mono (needs PyAV for m4a), cut at silences into segments of
+    # about STT_SEGMENT_SECONDS and transcribed STT_MAX_PARALLEL segments at a time
+    STT_SEGMENT_SECONDS: float = 15.0
+    STT_MAX_PARALLEL: int = 4
+    STT_MIN_SILENCE_MS: int = 250
+
+    # User session state ("memory" = per process, "sqlite" = shared by the workers of one node)
+    SESSION_BACKEND: str = "memory"
+    SESSION_PATH: str = "cache/sessions.db"
+    SESSION_TTL: int = 30 * 60
+    SESSION_MAX_ENTRIES: int = 10000
+
+    # textqa conversation memory (turns per user, context/summary budget in characters, idle seconds)
+    CHAT_MAX_TURNS: int = 6
+    CHAT_CONTEXT_CHARS: int = 2000
+    CHAT_SUMMARY_CHARS: int = 500
+    CHAT_IDLE_TTL: int = 30 * 60
+
+    # Answers of single-turn textqa questions reused for similar questions (Jaccard similarity of
+    # the normalized text's shingles; tokenizer "char" = character n-grams, "pythainlp" / "local" = word pairs)
+    SEMANTIC_CACHE_ENABLED: bool = True
+    SEMANTIC_CACHE_THRESHOLD: float = 0.85
+    SEMANTIC_CACHE_TTL: int = 24 * 60 * 60
+    SEMANTIC_CACHE_SIZE: int = 5000
+    SEMANTIC_CACHE_NGRAM: int = 3
+    SEMANTIC_CACHE_TOKENIZER: str = "char"
+
+    # Local Thai tokenizer (#tokenize, SEMANTIC_CACHE_TOKENIZER=local): word list or compiled .trie file
+    # ("" = the small bundled list); Thai runs it covers less than THAI_TOKENIZER_MIN_CONFIDENCE of
+    # go to the remote THAI_TOKENIZER_FALLBACK engine (trexplus / lexto / trexplusplus, "" = never)
+    THAI_LEXICON_PATH: str = ""
+    THAI_TOKENIZER_FALLBACK: str = "trexplus"
+    THAI_TOKENIZER_MIN_CONFIDENCE: float = 0.8
+
+    # Image model result cache ("sha256" = identical bytes, "phash" = also near-duplicate copies
+    # for the moderation models violence_classification and nsfw)
+    IMAGE_CACHE_MODE: str = "sha256"
+    IMAGE_CACHE_BACKEND: str = "memory"
+    IMAGE_CACHE_PATH: str = "cache/image_results.db"
+    IMAGE_CACHE_SIZE: int = 5000
+
+    # Several image models on one image ("3,4" or "all"): models running at once in total
+    # and the deadline of each model (seconds); the reply is sent when all are done or late
+    IMAGE_MULTI_WORKERS: int = 10
+    IMAGE_MODEL_DEADLINE: float = 20.0
+
+    # Background jobs (run by python -m app.job_worker): commands ("#tts"), image models ("super_resolution")
+    # and "partii" listed in JOBS_OFFLOAD are queued in JOBS_PATH and their results pushed when done
+    JOBS_ENABLED: bool = False
+    JOBS_OFFLOAD: list = ["super_resolution", "#tts", "#vajatts", "partii"]
+    JOBS_PATH: str = "cache/jobs.db"
+    JOBS_WORKERS: int = 2
+    JOBS_POLL_INTERVAL: float = 0.5
+    JOBS_LEASE_SECONDS: int = 300
+    JOBS_MAX_ATTEMPTS: int = 3
+    JOBS_BACKOFF_BASE: float = 5.0
+    JOBS_RETENTION: int = 7 * 24 * 60 * 60
+
+    # POST /nlp/batch: items running at once in total and per command
+    NLP_BATCH_CONCURRENCY: int = 16
+    NLP_BATCH_ENGINE_CONCURRENCY: int = 4
+
+    # Overrides of governor.DEFAULT_LIMITS as JSON, e.g. {"textqa": {"rate": 2, "max_concurrency": 4}}
+    UPSTREAM_LIMITS: dict = {}
+    # Overrides of resilience.DEFAULT_POLICIES as JSON, e.g. {"textqa": {"deadline": 30}}
+    UPSTREAM_POLICIES: dict = {}
+
     model_config = SettingsConfigDict(env_file=".env", extra="ignore",str_strip_whitespace=True)
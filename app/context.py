@@ -0,0 +1,131 @@
+import importlib
+import threading
+from functools import lru_cache
+
+from linebot import LineBotApi
+
+from app.configs import Configs
+
+# aift modules proxied by aift_module(), by module name (used by the warmup)
+aift_modules = {}
+
+_context = None
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_configs():
+    """The settings, read from the environment / .env once per process"""
+    return Configs()
+
+
+class AppContext:
+    """
+    ทรัพยากรที่ทุก router ใช้ร่วมกัน (settings และ LineBotApi) สร้างครั้งเดียวใน lifespan ของ FastAPI
+
+    แต่ละ router ยังมี WebhookHandler ของตัวเอง เพราะ callback ของ MessageEvent แต่ละ route ต่างกัน
+    """
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.line_bot_api = LineBotApi(
+            cfg.LINE_CHANNEL_ACCESS_TOKEN,  # CHANNEL_ACCESS_TOKEN
+            endpoint=cfg.LINE_API_ENDPOINT,
+            data_endpoint=cfg.LINE_API_DATA_ENDPOINT,
+        )
+
+
+def get_context():
+    """The shared AppContext (created on first use when the app runs without its lifespan)"""
+    global _context
+    if _context is None:
+        with _lock:
+            if _context is None:
+                _context = AppContext(get_configs())
+    return _context
+
+
+def open_context():
+    """Create the shared context and start importing the AIFT_WARMUP modules in the background"""
+    context = get_context()
+    names = warmup_names(context.cfg.AIFT_WARMUP)
+    if names:
+        threading.Thread(target=warm_up, args=(names,), name="aift-warmup", daemon=True).start()
+    return context
+
+
+def close_context():
+    global _context
+    with _lock:
+        _context = None
+
+
+class LazyModule:
+    """
+    Proxy of an aift module that is imported on first attribute access
+
+    Importing every aift engine up front (pythainlp alone takes seconds) slows down
+    every cold start, while most instances only ever use a few commands.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    _set_api_key()
+                    self._module = module
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<lazy aift module {self._name!r} ({state})>"
+
+
+def aift_module(name):
+    """Lazy proxy of the aift module name (e.g. "aift.nlp.tokenizer")"""
+    module = aift_modules.get(name)
+    if module is None:
+        module = aift_modules[name] = LazyModule(name)
+    return module
+
+
+@lru_cache(maxsize=None)
+def _set_api_key():
+    from aift import setting
+
+    setting.set_api_key(get_configs().AIFORTHAI_APIKEY)  # AIFORTHAI_APIKEY
+
+
+def warmup_names(names):
+    """AIFT_WARMUP entries as module names; "all" stands for every registered module"""
+    if "all" in names:
+        return list(aift_modules)
+    for name in names:
+        if name not in aift_modules:
+            print(f"[warmup] unknown aift module: {name}")
+    return [name for name in names if name in aift_modules]
+
+
+def warm_up(names):
+    for name in names:
+        try:
+            aift_modules[name]._load()
+        except Exception as e:
+            print(f"[warmup] {name} failed: {type(e).__name__}: {e}")
+
+
+def stats():
+    return {name: module.loaded for name, module in aift_modules.items()}
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class Conversation:
+    def __init__(self, session_id, max_turns):
+        self.session_id = session_id
+        self.turns = deque(maxlen=max_turns)
+        self.summary = ""
+        self.last_seen = time.monotonic()
+
+
+class ConversationMemory:
+    """
+    ประวัติการสนทนาของผู้ใช้แต่ละคน สำหรับส่งเป็น context ให้ textqa.chat
+
+    - เก็บ max_turns รอบล่าสุด (คำถาม, คำตอบ) ต่อผู้ใช้ รอบที่เก่ากว่านั้นถูกย่อเป็น summary
+    - context ที่ส่งให้ LLM ถูกตัดให้ไม่เกิน context_chars ตัวอักษร (summary ไม่เกิน summary_chars)
+    - ผู้ใช้ที่ไม่ได้คุยเกิน idle_ttl วินาทีจะถูกลบ และจำนวนผู้ใช้ไม่เกิน max_users (LRU)
+    """
+
+    # Per-turn length kept in the summary of compacted turns
+    SUMMARY_TURN_CHARS = 80
+    SUMMARY_HEADER = "สรุปการสนทนาก่อนหน้า:\n"
+
+    def __init__(self, max_turns=6, context_chars=2000, summary_chars=500, idle_ttl=1800, max_users=10000):
+        self.max_turns = max_turns
+        self.context_chars = context_chars
+        self.summary_chars = summary_chars
+        self.idle_ttl = idle_ttl
+        self.max_users = max_users
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def prepare(self, user_id):
+        """Return (session_id, context) to send with the next question of user_id"""
+        with self._lock:
+            self._evict_idle()
+            conversation = self._get(user_id)
+            return conversation.session_id, self._build_context(conversation)
+
+    def add_turn(self, user_id, question, answer):
+        with self._lock:
+            conversation = self._get(user_id)
+            if len(conversation.turns) == conversation.turns.maxlen:
+                self._compact(conversation, conversation.turns[0])
+            conversation.turns.append((question, answer))
+
+    def is_empty(self, user_id):
+        with self._lock:
+            conversation = self._conversations.get(user_id)
+            return conversation is None or (not conversation.turns and not conversation.summary)
+
+    def clear(self, user_id):
+        with self._lock:
+            self._conversations.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def _get(self, user_id):
+        conversation = self._conversations.get(user_id)
+        if conversation is None:
+            conversation = Conversation(f"{user_id}-{int(time.time())}", self.max_turns)
+            self._conversations[user_id] = conversation
+            while len(self._conversations) > self.max_users:
+                self._conversations.popitem(last=False)
+        conversation.last_seen = time.monotonic()
+        self._conversations.move_to_end(user_id)
+        return conversation
+
+    def _evict_idle(self):
+        deadline = time.monotonic() - self.idle_ttl
+        # Conversations are kept in last-used order, so the idle ones are at the front
+        while self._conversations:
+            user_id, conversation = next(iter(self._conversations.items()))
+            if conversation.last_seen > deadline:
+                break
+            del self._conversations[user_id]
+
+    def _compact(self, conversation, turn):
+        question, answer = turn
+        line = f"ผู้ใช้: {question[:self.SUMMARY_TURN_CHARS]} / ผู้ช่วย: {answer[:self.SUMMARY_TURN_CHARS]}"
+        lines = conversation.summary.split("\n") if conversation.summary else []
+        lines.append(line)
+        # Keep the most recent lines of the summary within its budget
+        while len(lines) > 1 and len("\n".join(lines)) > self.summary_chars:
+            lines.pop(0)
+        conversation.summary = "\n".join(lines)[-self.summary_chars:]
+
+    def _build_context(self, conversation):
+        budget = self.context_chars
+        summary = ""
+        if conversation.summary:
+            summary = self.SUMMARY_HEADER + conversation.summary
+            if len(summary) > budget:
+                summary = ""
+        budget -= len(summary)
+
+        # Newest turns first until the budget runs out; older turns that do not fit are left out
+        lines = []
+        for question, answer in reversed(conversation.turns):
+            line = f"ผู้ใช้: {question}\nผู้ช่วย: {answer}"
+            if len(line) + 1 > budget:
+                break
+            lines.append(line)
+            budget -= len(line) + 1
+
+        parts = [summary] if summary else []
+        parts.extend(reversed(lines))
+        return "\n".join(parts)
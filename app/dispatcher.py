@@ -0,0 +1,323 @@
+import asyncio
+import queue
+import threading
+import traceback
+from collections import deque
+
+from fastapi.concurrency import run_in_threadpool
+from linebot.exceptions import InvalidSignatureError
+from linebot.models import MessageEvent, TextSendMessage
+
+from app import line_reply, metrics
+from app.governor import BUSY_MESSAGE, UpstreamBusyError
+from app.idempotency import event_log
+from app.resilience import UNAVAILABLE_MESSAGE, UpstreamError
+
+# All dispatchers created by the service routers, keyed by name (used by /stats)
+dispatchers = {}
+
+
+class QueueFullError(Exception):
+    """The webhook queue has no room for some events; answer LINE with 503 so that it redelivers them"""
+
+
+def partition_key(event):
+    """Events of the same user are processed in order; events without a source share one partition"""
+    source = getattr(event, "source", None)
+    if source is None:
+        return ""
+    return (
+        getattr(source, "user_id", None)
+        or getattr(source, "group_id", None)
+        or getattr(source, "room_id", None)
+        or ""
+    )
+
+
+class PartitionedQueue:
+    """
+    Bounded queue ที่แบ่งอีเวนต์ตามผู้ใช้ (partition)
+
+    get() จะไม่คืนอีเวนต์ของ partition ที่ยังมี worker ทำอยู่ อีเวนต์ของผู้ใช้คนเดียวกันจึงทำทีละอัน
+    ตามลำดับเสมอ (เช่น "เลือกโมเดล 2" แล้วตามด้วยรูปภาพ) ส่วนผู้ใช้ต่างคนกันทำพร้อมกันได้
+    partition ที่พร้อมถูกหยิบแบบ round-robin ผู้ใช้ที่ส่งมาหลายอีเวนต์จึงไม่แซงคนอื่น
+    maxsize จำกัดจำนวนอีเวนต์ที่รออยู่รวมทุก partition
+    """
+
+    def __init__(self, maxsize=100):
+        self.maxsize = maxsize
+        self._partitions = {}  # key -> deque of waiting events
+        self._ready = deque()  # keys with waiting events and no event in progress
+        self._active = set()  # keys with an event in progress
+        self._pending = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def put_nowait(self, key, item):
+        with self._cond:
+            if self._pending >= self.maxsize:
+                raise queue.Full
+            events = self._partitions.get(key)
+            if events is None:
+                events = self._partitions[key] = deque()
+            events.append(item)
+            self._pending += 1
+            if len(events) == 1 and key not in self._active:
+                self._ready.append(key)
+                self._cond.notify()
+
+    def get(self):
+        """Block until an event of an idle partition is available; (None, None) once closed"""
+        with self._cond:
+            while not self._ready and not self._closed:
+                self._cond.wait()
+            if not self._ready:
+                return None, None
+            key = self._ready.popleft()
+            item = self._partitions[key].popleft()
+            self._pending -= 1
+            self._active.add(key)
+            return key, item
+
+    def task_done(self, key):
+        with self._cond:
+            self._active.discard(key)
+            if self._partitions[key]:
+                self._ready.append(key)
+                self._cond.notify()
+            else:
+                del self._partitions[key]
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def reopen(self):
+        with self._cond:
+            self._closed = False
+
+    def qsize(self):
+        return self._pending
+
+    def partitions(self):
+        return len(self._partitions)
+
+
+class WebhookDispatcher:
+    """
+    Ack-first dispatcher สำหรับ Line Webhook
+
+    ตรวจสอบลายเซ็นและแยกอีเวนต์ออกจาก body ทันที แล้วนำอีเวนต์เข้าคิวที่แบ่งตามผู้ใช้ (PartitionedQueue)
+    เพื่อให้ worker threads เรียก handler ที่ลงทะเบียนไว้กับ WebhookHandler
+    อีเวนต์ของผู้ใช้คนเดียวกันทำตามลำดับ ผู้ใช้ต่างคนกันทำพร้อมกันได้สูงสุด workers อีเวนต์
+    ทำให้ endpoint ตอบ 200 กลับไปยัง Line ได้ทันทีโดยไม่ต้องรอ AI FOR THAI
+
+    mode = "queue"  : ตอบกลับทันทีและประมวลผลใน worker pool
+    mode = "inline" : ประมวลผลจนเสร็จก่อนตอบกลับ (แต่รันใน threadpool ไม่บล็อก event loop)
+                      อีเวนต์ใน body เดียวกันแบ่งตามผู้ใช้แบบเดียวกับ mode queue
+
+    อีเวนต์ที่ webhookEventId เคยรับแล้ว (Line ส่งซ้ำ) จะถูกทิ้งก่อนเข้าคิว (ดู app.idempotency)
+
+    ถ้า upstream ไม่ว่าง (UpstreamBusyError) หรือล้มเหลว (UpstreamError) จะตอบผู้ใช้ด้วยข้อความสั้น ๆ
+    ผ่าน line_reply แทนการเงียบหายไป
+    """
+
+    def __init__(self, name, handler, mode="queue", workers=4, queue_size=100):
+        self.name = name
+        self.handler = handler
+        self.mode = mode
+        self.workers = workers
+        self.queue = PartitionedQueue(maxsize=queue_size)
+
+        self._threads = []
+        self._lock = threading.Lock()
+        self.busy = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self.shed = 0
+        self.upstream_failed = 0
+
+        dispatchers[name] = self
+
+    async def submit(self, body, signature):
+        """Validate the webhook body and hand its events over to the workers.
+
+        Raises InvalidSignatureError when the signature does not match, and
+        QueueFullError when the queue has no room for an event.
+        """
+        metrics.payload_bytes.inc(len(body.encode("utf-8")), route=self.name, kind="webhook_body")
+        try:
+            with metrics.phase_seconds.time(route=self.name, phase="signature_check"):
+                payload = self.handler.parser.parse(body, signature, as_payload=True)
+        except InvalidSignatureError:
+            metrics.webhook_requests.inc(route=self.name, result="invalid_signature")
+            raise
+        metrics.webhook_requests.inc(route=self.name, result="accepted")
+
+        # Redeliveries of events that were already accepted are dropped before any work starts
+        events = [event for event in payload.events if event_log.claim(self.name, event)]
+        with self._lock:
+            self.duplicates += len(payload.events) - len(events)
+
+        if self.mode == "inline":
+            await self._process_inline(events)
+            return
+
+        for i, event in enumerate(events):
+            try:
+                self.queue.put_nowait(partition_key(event), event)
+            except queue.Full:
+                # This webhook is answered with 503, so LINE redelivers it: forget the events
+                # that were not queued, while the queued ones stay claimed and are skipped then
+                for unqueued in events[i:]:
+                    event_log.release(self.name, unqueued)
+                with self._lock:
+                    self.dropped += len(events) - i
+                print(f"[{self.name}] webhook queue is full, {len(events) - i} events left for redelivery")
+                raise QueueFullError(f"{self.name} webhook queue is full")
+
+    async def _process_inline(self, events):
+        """Each user's events in order, different users concurrently (at most `workers` at once)"""
+        partitions = {}
+        for event in events:
+            partitions.setdefault(partition_key(event), []).append(event)
+        if len(partitions) == 1:
+            for event in events:
+                await run_in_threadpool(self._process, event)
+            return
+
+        limit = asyncio.Semaphore(self.workers)
+
+        async def run_partition(partition):
+            async with limit:
+                for event in partition:
+                    await run_in_threadpool(self._process, event)
+
+        await asyncio.gather(*(run_partition(partition) for partition in partitions.values()))
+
+    def start(self):
+        if self.mode == "inline" or self._threads:
+            return
+        self.queue.reopen()
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker, name=f"{self.name}-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5.0):
+        self.queue.close()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "partitions": self.queue.partitions(),
+            "workers": self.workers,
+            "busy_workers": self.busy,
+            "saturation": self.busy / self.workers if self.workers else 0.0,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "duplicates": self.duplicates,
+            "shed": self.shed,
+            "upstream_failed": self.upstream_failed,
+        }
+
+    def _worker(self):
+        while True:
+            key, event = self.queue.get()
+            if event is None:
+                break
+            with self._lock:
+                self.busy += 1
+            try:
+                self._process(event)
+            finally:
+                with self._lock:
+                    self.busy -= 1
+                self.queue.task_done(key)
+
+    def _process(self, event):
+        metrics.set_route(self.name)
+        try:
+            with metrics.in_flight.track(route=self.name), metrics.phase("handler"):
+                self.dispatch(event)
+            with self._lock:
+                self.processed += 1
+        except UpstreamBusyError as e:
+            with self._lock:
+                self.shed += 1
+            print(f"[{self.name}] {e}, load shed")
+            self.reply_error(event, BUSY_MESSAGE)
+        except UpstreamError as e:
+            with self._lock:
+                self.upstream_failed += 1
+            print(f"[{self.name}] {e}")
+            self.reply_error(event, UNAVAILABLE_MESSAGE)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            traceback.print_exc()
+
+    def reply_error(self, event, message):
+        if getattr(event, "reply_token", None) is None:
+            return
+        try:
+            line_reply.reply(event, TextSendMessage(text=message))
+        except Exception:
+            traceback.print_exc()
+
+    def dispatch(self, event):
+        """Run the handler registered for a single event.
+
+        Looks the function up the same way WebhookHandler.handle does:
+        "<Event>_<Message>" first, then "<Event>", then the default handler.
+        """
+        func = None
+        if isinstance(event, MessageEvent):
+            func = self.handler._handlers.get(
+                type(event).__name__ + "_" + type(event.message).__name__
+            )
+        if func is None:
+            func = self.handler._handlers.get(type(event).__name__)
+        if func is None:
+            func = self.handler._default
+        if func is not None:
+            func(event)
+
+
+queue_depth = metrics.Gauge(
+    "webhook_queue_depth",
+    "Events waiting in the dispatcher queue",
+    ["route"],
+    callback=lambda: {(name, ): d.queue.qsize() for name, d in dispatchers.items()},
+)
+busy_workers = metrics.Gauge(
+    "webhook_busy_workers",
+    "Dispatcher workers processing an event",
+    ["route"],
+    callback=lambda: {(name, ): d.busy for name, d in dispatchers.items()},
+)
+
+
+def start_all():
+    for dispatcher in dispatchers.values():
+        dispatcher.start()
+
+
+def stop_all():
+    for dispatcher in dispatchers.values():
+        dispatcher.stop()
+
+
+def stats_all():
+    return {name: dispatcher.stats() for name, dispatcher in dispatchers.items()}
@@ -0,0 +1,153 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from app.context import get_configs
+
+cfg = get_configs()
+
+BUSY_MESSAGE = "ขณะนี้มีผู้ใช้งานจำนวนมาก กรุณาลองใหม่อีกครั้งในภายหลัง (Service is busy, please retry)"
+
+# rate: requests per second (None = unlimited), burst: bucket size,
+# max_concurrency: calls in flight (None = unlimited), max_wait: seconds a call may queue before it is shed
+DEFAULT_LIMITS = {
+    "default": {"rate": 20, "burst": 40, "max_concurrency": 16, "max_wait": 5.0},
+    "textqa": {"rate": 5, "burst": 10, "max_concurrency": 8, "max_wait": 10.0},
+    "tokenizer": {"rate": 20, "burst": 40, "max_concurrency": 16, "max_wait": 5.0},
+    "tts": {"rate": 2, "burst": 4, "max_concurrency": 4, "max_wait": 10.0},
+    "partii": {"rate": 2, "burst": 4, "max_concurrency": 4, "max_wait": 10.0},
+    "face_blur": {"rate": 2, "burst": 4, "max_concurrency": 4, "max_wait": 10.0},
+    "chest_classification": {"rate": 2, "burst": 4, "max_concurrency": 4, "max_wait": 10.0},
+    "violence_classification": {"rate": 4, "burst": 8, "max_concurrency": 4, "max_wait": 10.0},
+    "nsfw": {"rate": 4, "burst": 8, "max_concurrency": 4, "max_wait": 10.0},
+    "super_resolution": {"rate": 1, "burst": 2, "max_concurrency": 2, "max_wait": 10.0},
+    "line_reply": {"rate": 100, "burst": 200, "max_concurrency": 32, "max_wait": 5.0},
+}
+
+
+class UpstreamBusyError(Exception):
+    """Raised when a call could not be admitted to an upstream within its wait deadline"""
+
+
+class Limiter:
+    """
+    Token bucket + concurrency limit ของ upstream หนึ่งตัว
+
+    call ที่ยังไม่ได้รับอนุญาตจะรอได้ไม่เกิน max_wait วินาที ถ้ารู้ล่วงหน้าว่ารอไม่ทัน
+    หรือรอจนหมดเวลาจะถูก shed ทันทีด้วย UpstreamBusyError แทนที่จะค้าง thread ไว้
+    """
+
+    def __init__(self, name, rate=None, burst=None, max_concurrency=None, max_wait=5.0):
+        self.name = name
+        self.rate = rate
+        self.burst = burst or rate or 1
+        self.max_concurrency = max_concurrency
+        self.max_wait = max_wait
+
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._semaphore = threading.Semaphore(max_concurrency) if max_concurrency else None
+
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.waiting = 0
+        self.in_flight = 0
+
+    @contextmanager
+    def slot(self):
+        deadline = time.monotonic() + self.max_wait
+        self._acquire(deadline)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+    def _acquire(self, deadline):
+        waited = False
+        if self.rate:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        break
+                    wait = (1 - self._tokens) / self.rate
+                    if now + wait > deadline:
+                        self._shed()
+                    if not waited:
+                        waited = True
+                        self.queued += 1
+                time.sleep(wait)
+
+        if self._semaphore is not None and not self._semaphore.acquire(blocking=False):
+            with self._lock:
+                if not waited:
+                    waited = True
+                    self.queued += 1
+                self.waiting += 1
+            acquired = self._semaphore.acquire(timeout=max(0.0, deadline - time.monotonic()))
+            with self._lock:
+                self.waiting -= 1
+                if not acquired:
+                    if self.rate:
+                        # The call is not made, so it gives its rate token back
+                        self._tokens = min(self.burst, self._tokens + 1)
+                    self._shed()
+
+        with self._lock:
+            self.admitted += 1
+            self.in_flight += 1
+
+    def _shed(self):
+        # Called with self._lock held
+        self.shed += 1
+        raise UpstreamBusyError(f"{self.name} is busy")
+
+    def stats(self):
+        return {
+            "rate": self.rate,
+            "max_concurrency": self.max_concurrency,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "shed": self.shed,
+        }
+
+
+class Governor:
+    """Limiter per upstream name, created on first use from DEFAULT_LIMITS and overrides"""
+
+    def __init__(self, limits=None):
+        self.limits = dict(DEFAULT_LIMITS)
+        for name, limit in (limits or {}).items():
+            self.limits[name] = {**self.limits.get(name, self.limits["default"]), **limit}
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, name):
+        limiter = self._limiters.get(name)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.get(name)
+                if limiter is None:
+                    limit = self.limits.get(name, self.limits["default"])
+                    limiter = self._limiters[name] = Limiter(name, **limit)
+        return limiter
+
+    def limit(self, name):
+        """Context manager admitting one call to upstream name (raises UpstreamBusyError)"""
+        return self.limiter(name).slot()
+
+    def stats(self):
+        return {name: limiter.stats() for name, limiter in self._limiters.items()}
+
+
+governor = Governor(cfg.UPSTREAM_LIMITS)
@@ -0,0 +1,95 @@
+import threading
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.context import get_configs
+
+cfg = get_configs()
+
+_lock = threading.Lock()
+_session = None
+_async_client = None
+
+
+def _timeout():
+    return (cfg.HTTP_CONNECT_TIMEOUT, cfg.HTTP_READ_TIMEOUT)
+
+
+def get_session():
+    """
+    Shared keep-alive requests.Session for direct AI FOR THAI calls
+
+    HTTPAdapter keeps up to HTTP_POOL_MAXSIZE connections per host and blocks
+    when they are all in use, so one host can never open more than that.
+    """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                adapter = HTTPAdapter(
+                    pool_connections=cfg.HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=cfg.HTTP_POOL_MAXSIZE,
+                    pool_block=True,
+                )
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def get_async_client():
+    """Shared httpx.AsyncClient for handlers running on the event loop"""
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(cfg.HTTP_READ_TIMEOUT, connect=cfg.HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=cfg.HTTP_POOL_CONNECTIONS * cfg.HTTP_POOL_MAXSIZE,
+                max_keepalive_connections=cfg.HTTP_POOL_MAXSIZE,
+            ),
+        )
+    return _async_client
+
+
+def request(method, url, **kwargs):
+    kwargs.setdefault("timeout", _timeout())
+    return get_session().request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+async def arequest(method, url, **kwargs):
+    return await get_async_client().request(method, url, **kwargs)
+
+
+async def aget(url, **kwargs):
+    return await arequest("GET", url, **kwargs)
+
+
+async def apost(url, **kwargs):
+    return await arequest("POST", url, **kwargs)
+
+
+def open_clients():
+    get_session()
+    get_async_client()
+
+
+async def close_clients():
+    global _session, _async_client
+    with _lock:
+        session, _session = _session, None
+    if session is not None:
+        session.close()
+    client, _async_client = _async_client, None
+    if client is not None:
+        await client.aclose()
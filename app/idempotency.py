@@ -0,0 +1,65 @@
+import time
+
+from app import metrics
+from app.cache import create_cache, make_key
+from app.context import get_configs
+
+cfg = get_configs()
+
+duplicate_events = metrics.Counter(
+    "webhook_duplicate_events_total", "Webhook events dropped because their id was already accepted", ["route"]
+)
+redelivered_events = metrics.Counter(
+    "webhook_redelivered_events_total", "Webhook events marked as redelivered by LINE", ["route"]
+)
+
+
+class EventLog:
+    """
+    บันทึก webhookEventId ที่รับแล้ว เพื่อทิ้งอีเวนต์ซ้ำก่อนเริ่มงาน AI
+
+    Line ส่ง webhook ซ้ำ (deliveryContext.isRedelivery = true) เมื่อบอทตอบช้า อีเวนต์ที่รับไปแล้ว
+    จะถูกทิ้งทันที ส่วนอีเวนต์ที่เป็น redelivery แต่ยังไม่เคยเห็น (เช่นครั้งแรกถูก drop) จะประมวลผลตามปกติ
+    id จะหมดอายุตาม ttl และจำกัดจำนวนด้วย max_entries
+    """
+
+    def __init__(self, backend="memory", path=None, ttl=24 * 60 * 60, max_entries=100000):
+        self.ttl = ttl
+        self._cache = create_cache(
+            "webhook_events", backend=backend, path=path, max_entries=max_entries, ttl=ttl
+        )
+
+    @staticmethod
+    def _key(route, event):
+        event_id = getattr(event, "webhook_event_id", None)
+        return make_key(route, event_id) if event_id else None
+
+    def claim(self, route, event):
+        """True when the event is new and should be processed, False for a duplicate"""
+        delivery_context = getattr(event, "delivery_context", None)
+        if delivery_context is not None and delivery_context.is_redelivery:
+            redelivered_events.inc(route=route)
+        key = self._key(route, event)
+        if key is None:
+            return True
+        if self._cache.add(key, time.time(), ttl=self.ttl):
+            return True
+        duplicate_events.inc(route=route)
+        return False
+
+    def release(self, route, event):
+        """Forget an event whose webhook is answered with an error, so that LINE's redelivery runs it"""
+        key = self._key(route, event)
+        if key is not None:
+            self._cache.delete(key)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+event_log = EventLog(
+    backend=cfg.WEBHOOK_DEDUP_BACKEND,
+    path=cfg.WEBHOOK_DEDUP_PATH,
+    ttl=cfg.WEBHOOK_DEDUP_TTL,
+    max_entries=cfg.WEBHOOK_DEDUP_MAX_ENTRIES,
+)
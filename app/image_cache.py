@@ -0,0 +1,67 @@
+import hashlib
+
+from PIL import Image
+
+from app.cache import create_cache, make_key
+
+# Models whose result is the same for a near-duplicate copy (content moderation); the others,
+# e.g. chest_classification or face_blur, depend on the exact pixels and always use sha256
+PHASH_MODELS = ("violence_classification", "nsfw")
+
+
+class ImageResultCache:
+    """
+    Cache ผลลัพธ์ของโมเดลรูปภาพ โดยใช้ key = (model, hash ของรูป)
+
+    mode = "sha256" : รูปต้องเหมือนกันทุก byte
+    mode = "phash"  : ใช้ difference hash (64 bit) ของรูป ทำให้รูปเดียวกันที่ถูกบีบอัดใหม่
+                      หรือย่อขนาด (เช่น ส่งต่อใน Line) ใช้ผลลัพธ์เดิมได้ เฉพาะโมเดลใน phash_models
+                      โมเดลอื่น (เช่นโมเดลทางการแพทย์) ยังใช้ sha256
+    """
+
+    def __init__(
+        self, mode="sha256", backend="memory", path=None, max_entries=5000, ttls=None, phash_models=PHASH_MODELS
+    ):
+        self.mode = mode
+        self.phash_models = set(phash_models)
+        self.ttls = ttls or {}
+        self._cache = create_cache("image_results", backend=backend, path=path, max_entries=max_entries)
+
+    def key(self, model, image):
+        """Key of a MediaBuffer for model; "phash" falls back to sha256 for unreadable images"""
+        if self.mode == "phash" and model in self.phash_models:
+            try:
+                return make_key(model, "dhash", dhash(image.open()))
+            except (OSError, ValueError, Image.DecompressionBombError):
+                pass
+        return make_key(model, "sha256", sha256(image.open()))
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, model, result):
+        self._cache.set(key, result, ttl=self.ttls.get(model))
+
+    def stats(self):
+        return self._cache.stats()
+
+
+def sha256(f, chunk_size=64 * 1024):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: f.read(chunk_size), b""):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dhash(f, size=8):
+    """Difference hash: compares neighbouring pixels of a (size+1) x size grayscale thumbnail"""
+    img = Image.open(f)
+    img.draft("L", (size * 8, size * 8))
+    pixels = list(img.convert("L").resize((size + 1, size), Image.Resampling.LANCZOS).getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{size * size // 4}x}"
@@ -0,0 +1,79 @@
+import io
+import threading
+
+from PIL import Image, ImageOps
+
+from app.media import MediaBuffer
+
+# Useful input size of each image model: (longest side in pixels, JPEG quality), None = send the original
+MODEL_PROFILES = {
+    "face_blur": (1600, 90),
+    "chest_classification": (1024, 92),
+    "violence_classification": (640, 85),
+    "nsfw": (512, 85),
+    "super_resolution": None,  # the original pixels are the whole point
+}
+
+_lock = threading.Lock()
+_stats = {"images": 0, "resized": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+def preprocess_image(image, model):
+    """
+    ย่อรูปภาพให้เหลือขนาดที่โมเดลใช้จริง ลบ EXIF และบีบอัด JPEG ใหม่ก่อนส่งไปยัง AI FOR THAI
+
+    image: MediaBuffer ของรูปจาก Line
+    return (MediaBuffer ที่จะส่ง, จำนวน bytes ที่ลดลง) ถ้าโมเดลต้องใช้รูปต้นฉบับ
+    หรือย่อแล้วไม่เล็กลง จะคืน image เดิม
+    """
+    profile = MODEL_PROFILES.get(model)
+    if profile is None:
+        _record(image.size, image.size, resized=False)
+        return image, 0
+
+    max_side, quality = profile
+    try:
+        data = _shrink(image.open(), max_side, quality)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # Not something Pillow can read, let the model decide
+        _record(image.size, image.size, resized=False)
+        return image, 0
+
+    if len(data) >= image.size:
+        _record(image.size, image.size, resized=False)
+        return image, 0
+
+    processed = MediaBuffer(spool_threshold=max(len(data), 1))
+    processed.write(data)
+    _record(image.size, len(data), resized=True)
+    return processed, image.size - len(data)
+
+
+def _shrink(f, max_side, quality):
+    img = Image.open(f)
+    # Let the JPEG decoder skip detail we are about to throw away
+    img.draft("RGB", (max_side, max_side))
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    out = io.BytesIO()
+    # No exif= argument, so the metadata is dropped
+    img.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def _record(bytes_in, bytes_out, resized):
+    with _lock:
+        _stats["images"] += 1
+        _stats["resized"] += int(resized)
+        _stats["bytes_in"] += bytes_in
+        _stats["bytes_out"] += bytes_out
+
+
+def stats():
+    with _lock:
+        result = dict(_stats)
+    result["bytes_saved"] = result["bytes_in"] - result["bytes_out"]
+    return result
@@ -0,0 +1,124 @@
+"""
+Worker processes of the background job queue (app/jobs.py)
+
+    python -m app.job_worker [--processes N]
+
+Each process leases one job at a time, runs its handler and pushes the result
+to the user. Throughput grows with the number of processes on the node; they
+share the queue through the SQLite file, so they may be started separately too.
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+
+from linebot.models import TextSendMessage
+
+from app.context import get_configs
+
+cfg = get_configs()
+
+# Finished jobs older than JOBS_RETENTION are deleted this often (seconds)
+PURGE_INTERVAL = 600
+
+
+def run_job(job_queue, job, worker):
+    handler = job_queue.get_handler(job.kind)
+    to = job.payload.get("to")
+    started = time.monotonic()
+    try:
+        if job.result is None:
+            if handler is None:
+                raise ValueError(f"no handler for job kind {job.kind!r}")
+            # The lease is renewed while the handler runs, so a long job is not leased to a second worker
+            with job_queue.keep_leased(job):
+                messages = handler(job.payload)
+            # Pushed only by the owner of the lease; a failed push is retried from the stored result
+            if not job_queue.save_result(job, messages or []):
+                return
+        if job.result and to:
+            from app import line_reply
+
+            line_reply.push(to, job.messages())
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        retry = job_queue.fail(job, error)
+        print(f"[{worker}] job {job.id} ({job.kind}) attempt {job.attempts} failed: {error}")
+        if not retry:
+            traceback.print_exc()
+            if to:
+                _push_failure(to)
+        return
+    if job_queue.complete(job):
+        print(f"[{worker}] job {job.id} ({job.kind}) done in {time.monotonic() - started:.2f}s")
+
+
+def _push_failure(to):
+    from app import line_reply
+
+    try:
+        line_reply.push(to, TextSendMessage(text="Sorry, processing failed. Please try again later."))
+    except Exception as e:
+        print(f"[jobs] failure notice not sent: {type(e).__name__}: {e}")
+
+
+def work(index, stop=None):
+    """Loop of one worker process: lease, run, repeat until stop is set (SIGTERM / SIGINT)"""
+    stop = stop or threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+
+    # Registers the job handlers of every router
+    from app import metrics, service_image, service_nlp  # noqa: F401
+    from app.jobs import job_queue
+
+    worker = f"{socket.gethostname()}:{os.getpid()}:{index}"
+    metrics.set_route("jobs")
+    print(f"[{worker}] waiting for jobs in {cfg.JOBS_PATH}")
+    purged_at = 0.0
+    while not stop.is_set():
+        if time.monotonic() - purged_at >= PURGE_INTERVAL:
+            job_queue.purge(cfg.JOBS_RETENTION)
+            purged_at = time.monotonic()
+        for job in job_queue.expire():
+            print(f"[{worker}] job {job.id} ({job.kind}) given up: its worker was lost on attempt {job.attempts}")
+            if job.payload.get("to"):
+                _push_failure(job.payload["to"])
+        job = job_queue.lease(worker)
+        if job is None:
+            stop.wait(cfg.JOBS_POLL_INTERVAL)
+            continue
+        run_job(job_queue, job, worker)
+    print(f"[{worker}] stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run background job workers")
+    parser.add_argument("--processes", type=int, default=cfg.JOBS_WORKERS, help="default JOBS_WORKERS")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        work(0)
+        return
+
+    processes = [
+        multiprocessing.Process(target=work, args=(i,), name=f"job-worker-{i}") for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    # Workers finish their current job on SIGTERM / SIGINT
+    signal.signal(signal.SIGTERM, lambda *_: [process.terminate() for process in processes])
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
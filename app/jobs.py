@@ -0,0 +1,315 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from linebot.models import AudioSendMessage, ImageSendMessage, TextSendMessage
+
+from app import line_reply, metrics
+from app.context import get_configs
+
+cfg = get_configs()
+
+STATUSES = ("queued", "running", "done", "failed")
+
+# Send message classes of the results stored on the jobs table, by their "type"
+MESSAGE_TYPES = {"text": TextSendMessage, "image": ImageSendMessage, "audio": AudioSendMessage}
+
+jobs_total = metrics.Counter("jobs_total", "Background jobs finished, by kind and result", ["kind", "result"])
+
+
+class Job:
+    def __init__(self, id, kind, payload, attempts, worker=None, result=None):
+        self.id = id
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+        self.worker = worker  # owner of the lease
+        self.result = result  # messages of a finished handler that still have to be pushed
+
+    def messages(self):
+        return [MESSAGE_TYPES[message["type"]].new_from_json_dict(message) for message in self.result or []]
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.kind} attempt {self.attempts}>"
+
+
+class JobQueue:
+    """
+    คิวงานที่ใช้เวลานาน (super resolution, TTS, ถอดเสียงยาว) เก็บใน SQLite (WAL) จึงไม่หายเมื่อ process restart
+
+    webhook แค่ enqueue งาน ส่วน worker process (python -m app.job_worker) จะ lease งานทีละชิ้น
+    ถ้า worker ตายระหว่างทำ งานจะถูก lease ใหม่เมื่อ lease หมดอายุ งานที่ล้มเหลวจะลองใหม่แบบ backoff
+    จนครบ max_attempts ผลลัพธ์ส่งให้ผู้ใช้ด้วย push message ใช้ไฟล์เดียวกันได้จากหลาย process บนเครื่องเดียวกัน
+    """
+
+    def __init__(self, path, lease_seconds=300, max_attempts=3, backoff_base=5.0, backoff_cap=300.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._handlers = {}
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Opened on first use, so that the file is only created where jobs are used
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL, "
+                "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, "
+                "run_at REAL NOT NULL, lease_until REAL, worker TEXT, error TEXT, result TEXT, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            if "result" not in {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}:
+                conn.execute("ALTER TABLE jobs ADD COLUMN result TEXT")  # file of an older version
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, run_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def handler(self, kind):
+        """Decorator registering func(payload) as the job handler of kind; it returns the messages to push"""
+
+        def decorator(func):
+            self._handlers[kind] = func
+            return func
+
+        return decorator
+
+    def get_handler(self, kind):
+        return self._handlers.get(kind)
+
+    def enqueue(self, kind, payload, max_attempts=None):
+        """Add a job (payload must be JSON serializable) and return its id"""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, payload, status, max_attempts, run_at, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (kind, json.dumps(payload), max_attempts or self.max_attempts, now, now, now),
+            )
+            conn.commit()
+            return cursor.lastrowid
+
+    def lease(self, worker):
+        """
+        Take the oldest due job for lease_seconds, or None
+
+        A running job whose lease has expired (its worker died) is due again while it has
+        attempts left (see expire()). The single UPDATE ... RETURNING makes the lease atomic across processes.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, worker = ?, "
+                "updated_at = ? WHERE id = (SELECT id FROM jobs WHERE "
+                "(status = 'queued' AND run_at <= ?) "
+                "OR (status = 'running' AND lease_until < ? AND attempts < max_attempts) "
+                "ORDER BY run_at LIMIT 1) RETURNING id, kind, payload, attempts, result",
+                (now + self.lease_seconds, worker, now, now, now),
+            ).fetchone()
+            conn.commit()
+        if row is None:
+            return None
+        return Job(row[0], row[1], json.loads(row[2]), row[3], worker, json.loads(row[4]) if row[4] else None)
+
+    def expire(self):
+        """
+        Fail the running jobs whose lease expired on their last attempt and return them
+
+        A job that keeps killing its worker (out of memory, a crash on a bad file) is not leased forever.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute(
+                "UPDATE jobs SET status = 'failed', lease_until = NULL, error = ?, updated_at = ? "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts "
+                "RETURNING id, kind, payload, attempts, worker",
+                ("worker lost on the last attempt", now, now),
+            ).fetchall()
+            conn.commit()
+        jobs = [Job(row[0], row[1], json.loads(row[2]), row[3], row[4]) for row in rows]
+        for job in jobs:
+            jobs_total.inc(kind=job.kind, result="failed")
+        return jobs
+
+    def renew(self, job):
+        """Extend the lease of a running job by lease_seconds; False when its worker no longer holds it"""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (now + self.lease_seconds, now, job.id, job.worker),
+            )
+            conn.commit()
+        return cursor.rowcount > 0
+
+    @contextmanager
+    def keep_leased(self, job):
+        """Renew the lease of job every third of lease_seconds while the block runs (a job may outlast one lease)"""
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.lease_seconds / 3):
+                if not self.renew(job):
+                    print(f"[jobs] job {job.id} lease lost by {job.worker}")
+                    return
+
+        thread = threading.Thread(target=heartbeat, name=f"job-{job.id}-lease", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def save_result(self, job, messages):
+        """
+        Store the messages of a finished handler on the job before they are pushed, so that a failed
+        push is retried without running the handler again; False when the lease has passed to another worker
+        """
+        result = [message.as_json_dict() for message in messages]
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.execute(
+                "UPDATE jobs SET result = ?, updated_at = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (json.dumps(result, ensure_ascii=False), now, job.id, job.worker),
+            )
+            conn.commit()
+        if cursor.rowcount == 0:
+            print(f"[jobs] job {job.id} is no longer leased by {job.worker}, its result is not pushed")
+            return False
+        job.result = result
+        return True
+
+    def complete(self, job):
+        """Mark a job done; False (nothing recorded) when its lease has passed to another worker"""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', lease_until = NULL, error = NULL, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (now, job.id, job.worker),
+            )
+            conn.commit()
+        if cursor.rowcount == 0:
+            print(f"[jobs] job {job.id} is no longer leased by {job.worker}, its result is not recorded")
+            return False
+        jobs_total.inc(kind=job.kind, result="done")
+        return True
+
+    def fail(self, job, error):
+        """
+        Record a failed attempt; returns True when the job will be retried (after a backoff)
+
+        A job whose lease has passed to another worker is left to that worker (and counts as retried).
+        """
+        now = time.time()
+        backoff = random.uniform(0.5, 1.0) * min(self.backoff_cap, self.backoff_base * 2 ** (job.attempts - 1))
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END, "
+                "run_at = ?, lease_until = NULL, error = ?, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running' RETURNING status",
+                (now + backoff, error, now, job.id, job.worker),
+            ).fetchone()
+            conn.commit()
+        if row is None:
+            print(f"[jobs] job {job.id} is no longer leased by {job.worker}, its failure is not recorded")
+            return True
+        retry = row[0] == "queued"
+        jobs_total.inc(kind=job.kind, result="retry" if retry else "failed")
+        return retry
+
+    def status(self, job_id):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT id, kind, status, attempts, max_attempts, error, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "kind", "status", "attempts", "max_attempts", "error", "created_at", "updated_at")
+        return dict(zip(keys, row))
+
+    def purge(self, older_than):
+        """Delete finished jobs last updated more than older_than seconds ago"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (time.time() - older_than,)
+            )
+            conn.commit()
+
+    def stats(self):
+        """Jobs by status and the lag of the oldest due job (seconds it has been waiting for a worker)"""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            oldest = conn.execute(
+                "SELECT MIN(run_at) FROM jobs WHERE status = 'queued' AND run_at <= ?", (now,)
+            ).fetchone()[0]
+        result = {status: counts.get(status, 0) for status in STATUSES}
+        result["lag_seconds"] = now - oldest if oldest is not None else 0.0
+        return result
+
+
+job_queue = JobQueue(
+    cfg.JOBS_PATH,
+    lease_seconds=cfg.JOBS_LEASE_SECONDS,
+    max_attempts=cfg.JOBS_MAX_ATTEMPTS,
+    backoff_base=cfg.JOBS_BACKOFF_BASE,
+)
+
+
+def offload(event, kind, payload, name):
+    """
+    Queue a kind job for event when name (a command, image model or "partii") is in JOBS_OFFLOAD
+
+    The reply token is used at once to acknowledge, the result is pushed by a worker.
+    Returns False (nothing queued) when the work should run inline.
+    """
+    to = line_reply.push_target(event)
+    if not cfg.JOBS_ENABLED or name not in cfg.JOBS_OFFLOAD or to is None:
+        return False
+    job_id = job_queue.enqueue(kind, dict(payload, to=to))
+    print(f"[jobs] queued {kind} job {job_id} ({name})")
+    line_reply.reply(event, TextSendMessage(text="Processing, the result will be sent when it is ready"))
+    return True
+
+
+def stats():
+    return job_queue.stats() if cfg.JOBS_ENABLED else {}
+
+
+def _gauge(field):
+    if not cfg.JOBS_ENABLED:
+        return {}
+    return {(): job_queue.stats()[field]}
+
+
+jobs_queued = metrics.Gauge("jobs_queued", "Jobs waiting for a worker", callback=lambda: _gauge("queued"))
+jobs_running = metrics.Gauge("jobs_running", "Jobs leased by a worker", callback=lambda: _gauge("running"))
+jobs_lag = metrics.Gauge(
+    "jobs_lag_seconds", "Seconds the oldest due job has been waiting", callback=lambda: _gauge("lag_seconds")
+)
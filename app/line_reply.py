@@ -0,0 +1,120 @@
+import math
+import time
+
+from linebot.exceptions import LineBotApiError
+
+from app import http_client, metrics
+from app.cache import MemoryCache
+from app.context import get_configs, get_context
+from app.governor import governor
+
+cfg = get_configs()
+
+replies = metrics.Counter(
+    "line_replies_total", "Messages sent to LINE users by delivery (reply, push, expired, failed)", ["route", "via"]
+)
+loading_animations = metrics.Counter("line_loading_animations_total", "Loading animations shown", ["route"])
+
+# Reply tokens of events that will miss their deadline, answered by push without trying the token
+_push_tokens = MemoryCache(max_entries=10000, ttl=cfg.REPLY_TOKEN_TTL)
+
+
+def token_deadline(event):
+    """Epoch seconds after which the event's reply token should no longer be used"""
+    return event.timestamp / 1000 + cfg.REPLY_TOKEN_TTL - cfg.REPLY_DEADLINE_MARGIN
+
+
+def time_left(event):
+    return token_deadline(event) - time.time()
+
+
+def push_target(event):
+    source = getattr(event, "source", None)
+    if source is None:
+        return None
+    return getattr(source, "user_id", None) or getattr(source, "group_id", None) or getattr(source, "room_id", None)
+
+
+def expected_seconds(histogram, min_count=20, **labels):
+    """p95 of histogram for labels, or None until it has min_count observations"""
+    snapshot = histogram.snapshot(**labels)
+    if snapshot is None or snapshot[2] < min_count:
+        return None
+    return histogram.quantile(0.95, **labels)
+
+
+def begin(event, expected):
+    """
+    Call before slow work on event; expected is its p95 in seconds (None when unknown)
+
+    ถ้าคาดว่างานจะช้า จะแสดง loading animation ในแชต 1:1 และถ้าคาดว่าทำเสร็จหลัง reply token
+    หมดอายุ จะตอบด้วย push message ทันทีเมื่อเสร็จ โดยไม่เสียเวลาลองใช้ token ที่หมดอายุแล้ว
+    ถ้ายังไม่รู้ latency (expected เป็น None) จะไม่แสดง animation เพราะการเรียก LINE API นั้นทำแบบ synchronous
+    """
+    if expected is not None and expected >= cfg.REPLY_LOADING_THRESHOLD:
+        show_loading(event, expected)
+    if expected is not None and expected >= time_left(event) and event.reply_token:
+        _push_tokens.set(event.reply_token, True)
+
+
+def show_loading(event, expected=None):
+    """Start LINE's loading animation for expected seconds (5 to 60); only 1:1 chats support it"""
+    source = getattr(event, "source", None)
+    if not cfg.REPLY_LOADING_ANIMATION or getattr(source, "type", None) != "user":
+        return
+    seconds = min(60, max(5, 5 * math.ceil((expected or 20) / 5)))
+    try:
+        http_client.post(
+            cfg.LINE_API_ENDPOINT + "/v2/bot/chat/loading/start",
+            json={"chatId": source.user_id, "loadingSeconds": seconds},
+            headers={"Authorization": "Bearer " + cfg.LINE_CHANNEL_ACCESS_TOKEN},
+            timeout=(cfg.HTTP_CONNECT_TIMEOUT, 5.0),
+        )
+        loading_animations.inc(route=metrics.current_route())
+    except Exception as e:
+        print(f"[line_reply] loading animation failed: {type(e).__name__}: {e}")
+
+
+def reply(event, messages):
+    """
+    Answer event with its reply token, or with a push message when the token has
+    expired (or is expected to) and REPLY_PUSH_FALLBACK is on
+    """
+    route = metrics.current_route()
+    line_bot_api = get_context().line_bot_api
+    token = event.reply_token
+    use_push = _push_tokens.get(token) is not None or time_left(event) <= 0
+    _push_tokens.delete(token)
+
+    if not use_push:
+        try:
+            with governor.limit("line_reply"), metrics.phase("line_reply"):
+                line_bot_api.reply_message(token, messages)
+            replies.inc(route=route, via="reply")
+            return
+        except LineBotApiError as e:
+            # Other 400s (an invalid or oversized message) would fail as a push too
+            if not token_rejected(e):
+                replies.inc(route=route, via="failed")
+                raise
+            print(f"[line_reply] reply token rejected: {e.error.message}")
+
+    to = push_target(event)
+    if not cfg.REPLY_PUSH_FALLBACK or to is None:
+        replies.inc(route=route, via="expired")
+        print("[line_reply] reply token expired and push fallback is off, message not sent")
+        return
+    push(to, messages)
+
+
+def token_rejected(error):
+    """Whether a LineBotApiError says the reply token has expired or was already used ("Invalid reply token")"""
+    message = (getattr(error.error, "message", None) or "").lower()
+    return error.status_code == 400 and "reply token" in message and ("invalid" in message or "expired" in message)
+
+
+def push(to, messages):
+    """Send messages to a user, group or room id without a reply token (e.g. results of background jobs)"""
+    with governor.limit("line_reply"), metrics.phase("line_push"):
+        get_context().line_bot_api.push_message(to, messages)
+    replies.inc(route=metrics.current_route(), via="push")
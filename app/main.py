@@ -1,19 +1,44 @@
 import os
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles  # For Vaja9
 
 from app import (
+    cache,  # result caches
+    context,  # shared settings / LineBotApi and lazy aift modules
+    dispatcher,  # webhook worker pools
+    governor,  # per-upstream rate limits
+    http_client,  # shared keep-alive HTTP client
+    jobs,  # background job queue
+    image_preprocess,  # image shrinking before upload
+    metrics,  # Prometheus metrics
+    resilience,  # deadlines, retries and circuit breakers
     service_main,  # main service router
     service_nlp,  # NLP service router
     service_image,# image service router
+    singleflight,  # coalescing of identical upstream calls in flight
 )
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    context.open_context()
+    http_client.open_clients()
+    dispatcher.start_all()
+    yield
+    dispatcher.stop_all()
+    await http_client.close_clients()
+    context.close_context()
+
+
 app = FastAPI(
     title="aiforthai-line-chatbot",
     description="AIFORTHAI LINE CHATBOT WORKSHOP",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 origins = ["*"]
@@ -37,3 +62,32 @@ app.mount("/static/", StaticFiles(directory="static"), name="static")
 @app.get("/")
 def index():
     return "AIFORTHAI LINE CHATBOT WORKSHOP"
+
+@app.get("/stats")
+def stats():
+    """Queue depth and worker saturation of each webhook dispatcher, cache hit rates and coalesced calls"""
+    return {
+        "dispatchers": dispatcher.stats_all(),
+        "caches": cache.stats_all(),
+        "image_preprocess": image_preprocess.stats(),
+        "upstreams": governor.governor.stats(),
+        "circuits": resilience.resilience.stats(),
+        "aift_modules": context.stats(),
+        "singleflight": singleflight.stats_all(),
+        "jobs": jobs.stats(),
+    }
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: int):
+    """Status, attempts and last error of a background job"""
+    status = jobs.job_queue.status(job_id) if jobs.cfg.JOBS_ENABLED else None
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Latency histograms, error counters, payload bytes and in-flight gauges in Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
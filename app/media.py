@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from app import metrics
+
+
+class MediaBuffer:
+    """
+    Buffer ของไฟล์สื่อ (รูปภาพ/เสียง) จาก Line สำหรับแต่ละ request
+
+    เก็บข้อมูลไว้ในหน่วยความจำ และย้ายไปเป็นไฟล์ชั่วคราวเมื่อขนาดเกิน spool_threshold
+    ผู้ใช้แต่ละคนจึงไม่เขียนทับไฟล์ของกันและกัน และ buffer ถูกลบเมื่อปิด (close / with)
+    """
+
+    def __init__(self, spool_threshold=1024 * 1024):
+        self._file = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+        self.size = 0
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def getvalue(self):
+        self._file.seek(0)
+        return self._file.read()
+
+    def open(self):
+        """Return the underlying file object rewound to the start"""
+        self._file.seek(0)
+        return self._file
+
+    @contextmanager
+    def as_file(self, suffix=""):
+        """
+        Materialize the buffer as a private temporary file for APIs that only accept a path
+        (e.g. the aift image analyzers); the file is deleted on exit
+        """
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(self.open(), f)
+            yield path
+        finally:
+            os.remove(path)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def fetch_message_content(line_bot_api, message_id, chunk_size=64 * 1024, spool_threshold=1024 * 1024):
+    """Stream the content of a LINE image/audio message into a new MediaBuffer"""
+    with metrics.phase("media_download"):
+        content = line_bot_api.get_message_content(message_id)
+        buffer = MediaBuffer(spool_threshold)
+        try:
+            for chunk in content.iter_content(chunk_size):
+                buffer.write(chunk)
+        except Exception:
+            buffer.close()
+            raise
+    metrics.payload_bytes.inc(buffer.size, route=metrics.current_route(), kind="media_download")
+    return buffer
@@ -0,0 +1,223 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = "aiforthai_linebot_"
+
+# Seconds; AI FOR THAI calls range from tens of milliseconds to tens of seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+_metrics = []
+_local = threading.local()
+
+
+def set_route(route):
+    """Remember which router the current worker thread is serving (used as the route label)"""
+    _local.route = route
+
+
+def current_route():
+    return getattr(_local, "route", "")
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name, help, labels=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name, help, labels=(), callback=None):
+        """callback() may return {labels tuple: value} to read counts kept elsewhere at scrape time"""
+        super().__init__(name, help, labels)
+        self._values = {}
+        self.callback = callback
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        if self.callback is not None:
+            items = list(self.callback().items())
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{self._format_labels(key)} {value}" for key, value in items]
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name, help, labels=(), callback=None):
+        """callback() may return {labels tuple: value} to read the values at scrape time"""
+        super().__init__(name, help, labels)
+        self._values = {}
+        self.callback = callback
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    @contextmanager
+    def track(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _samples(self):
+        if self.callback is not None:
+            items = list(self.callback().items())
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{self._format_labels(key)} {value}" for key, value in items]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # key -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self, **labels):
+        """(bucket upper bounds, cumulative counts, count) of one label set, or None"""
+        with self._lock:
+            counts = self._values.get(self._key(labels))
+            counts = list(counts) if counts is not None else None
+        if counts is None:
+            return None
+        cumulative = []
+        total = 0
+        for count in counts[:-1]:
+            total += count
+            cumulative.append(total)
+        return self.buckets + (float("inf"),), cumulative, total
+
+    def quantile(self, q, **labels):
+        """
+        Estimated q-quantile, interpolated linearly inside its bucket like Prometheus'
+        histogram_quantile (None without observations)
+        """
+        snapshot = self.snapshot(**labels)
+        if snapshot is None or snapshot[2] == 0:
+            return None
+        bounds, cumulative, total = snapshot
+        rank = q * total
+        lower, below = 0.0, 0
+        for bound, count in zip(bounds, cumulative):
+            if count >= rank:
+                if bound == float("inf"):
+                    return lower
+                return lower + (bound - lower) * (rank - below) / (count - below)
+            lower, below = bound, count
+        return lower
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        lines = []
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f"{self.name}_bucket{self._format_labels(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {counts[-1]}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+######### Metrics of the webhook pipeline #####
+webhook_requests = Counter("webhook_requests_total", "Webhook requests received", ["route", "result"])
+phase_seconds = Histogram(
+    "phase_seconds",
+    "Time spent per request phase (signature_check, media_download, upstream, line_reply, handler)",
+    ["route", "phase"],
+)
+in_flight = Gauge("events_in_flight", "Webhook events being processed", ["route"])
+payload_bytes = Counter("payload_bytes_total", "Payload bytes by kind", ["route", "kind"])
+
+command_seconds = Histogram(
+    "nlp_command_seconds", "Latency of NLP commands that missed the reply cache (hits are not observed)", ["command"]
+)
+upstream_seconds = Histogram(
+    "upstream_seconds", "Latency of upstream calls (textqa, NLP engines, image models, ...)", ["upstream"]
+)
+upstream_errors = Counter(
+    "upstream_errors_total", "Upstream calls that failed, by kind (error, timeout, circuit_open, busy)",
+    ["upstream", "kind"],
+)
+upstream_in_flight = Gauge("upstream_in_flight", "Upstream calls in flight", ["upstream"])
+
+
+@contextmanager
+def phase(name):
+    """Time a phase of the request handled by the current thread"""
+    with phase_seconds.time(route=current_route(), phase=name):
+        yield
@@ -0,0 +1,194 @@
+import random
+import threading
+import time
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import httpx
+import requests
+
+from app import metrics
+from app.context import get_configs
+from app.governor import UpstreamBusyError, governor
+
+cfg = get_configs()
+
+UNAVAILABLE_MESSAGE = "บริการนี้ไม่พร้อมใช้งานชั่วคราว กรุณาลองใหม่อีกครั้งในภายหลัง (Service temporarily unavailable)"
+
+# deadline: seconds for the whole call including retries, retries: extra attempts (idempotent calls only),
+# failure_threshold: consecutive failures that open the circuit, reset_timeout: seconds before a half-open probe
+DEFAULT_POLICIES = {
+    "default": {"deadline": 30.0, "retries": 2, "idempotent": True, "failure_threshold": 5, "reset_timeout": 30.0},
+    "textqa": {"deadline": 60.0, "retries": 0, "idempotent": False},
+    "tts": {"deadline": 60.0, "retries": 1},
+    "partii": {"deadline": 60.0, "retries": 1},
+    "face_blur": {"deadline": 45.0, "retries": 1},
+    "chest_classification": {"deadline": 45.0, "retries": 1},
+    "super_resolution": {"deadline": 90.0, "retries": 0},
+}
+
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+
+
+class UpstreamError(Exception):
+    """Raised when an upstream call failed after its retries or ran past its deadline"""
+
+
+class CircuitOpenError(UpstreamError):
+    """Raised without calling the upstream while its circuit is open"""
+
+
+# Errors that mean the upstream failed (network, timeout, HTTP or an error payload without the expected keys).
+# Anything else (e.g. a malformed user command) is raised as is and does not count against the circuit.
+UPSTREAM_ERRORS = (requests.RequestException, httpx.HTTPError, OSError, KeyError, FutureTimeoutError, UpstreamError)
+
+
+class CircuitBreaker:
+    """
+    closed    : ทุก call ผ่าน, ล้มเหลวติดกัน failure_threshold ครั้งแล้วเปลี่ยนเป็น open
+    open      : ปฏิเสธทุก call ทันที (fail fast) จนครบ reset_timeout วินาที
+    half_open : ให้ probe ผ่านได้ทีละ call ถ้าสำเร็จกลับเป็น closed ถ้าล้มเหลวกลับเป็น open
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def release(self):
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def stats(self):
+        return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
+
+
+class Resilience:
+    """
+    เรียก upstream ผ่าน governor พร้อม deadline, retry แบบ jittered exponential backoff
+    (เฉพาะ call ที่ idempotent) และ circuit breaker ต่อ upstream
+
+    call ที่ไม่มี timeout ของตัวเอง (เช่น aift) ถูกรันใน thread pool แยก เพื่อให้ worker
+    เลิกรอได้เมื่อถึง deadline แม้ socket เดิมจะยังค้างอยู่
+    """
+
+    def __init__(self, policies=None, max_threads=64):
+        self.policies = dict(DEFAULT_POLICIES)
+        for name, policy in (policies or {}).items():
+            self.policies[name] = {**self.policies.get(name, {}), **policy}
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="upstream")
+
+    def policy(self, name):
+        return {**self.policies["default"], **self.policies.get(name, {})}
+
+    def breaker(self, name):
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(name)
+                if breaker is None:
+                    policy = self.policy(name)
+                    breaker = self._breakers[name] = CircuitBreaker(
+                        name, policy["failure_threshold"], policy["reset_timeout"]
+                    )
+        return breaker
+
+    def call(self, upstream, fn, *args, deadline=None, **kwargs):
+        """Call fn(*args, **kwargs) as a request to upstream; raises UpstreamError / UpstreamBusyError"""
+        with metrics.phase("upstream"):
+            return self._call(upstream, fn, args, kwargs, deadline)
+
+    def _call(self, upstream, fn, args, kwargs, deadline):
+        policy = self.policy(upstream)
+        deadline_at = time.monotonic() + (deadline or policy["deadline"])
+        attempts = 1 + (policy["retries"] if policy["idempotent"] else 0)
+        breaker = self.breaker(upstream)
+
+        for attempt in range(attempts):
+            if not breaker.allow():
+                metrics.upstream_errors.inc(upstream=upstream, kind="circuit_open")
+                raise CircuitOpenError(f"{upstream} circuit is open")
+            try:
+                with ExitStack() as admitted:
+                    admitted.enter_context(governor.limit(upstream))
+                    admitted.enter_context(metrics.upstream_in_flight.track(upstream=upstream))
+                    remaining = deadline_at - time.monotonic()
+                    if remaining <= 0:
+                        raise FutureTimeoutError()
+                    future = self._executor.submit(fn, *args, **kwargs)
+                    with metrics.upstream_seconds.time(upstream=upstream):
+                        try:
+                            result = future.result(timeout=remaining)
+                        except FutureTimeoutError:
+                            # A running call cannot be stopped: it keeps its governor slot until it
+                            # returns, so abandoned calls still count against the upstream's limit
+                            if not future.cancel():
+                                slot = admitted.pop_all()
+                                future.add_done_callback(lambda _: slot.close())
+                            raise
+            except UPSTREAM_ERRORS as e:
+                breaker.record_failure()
+                timed_out = isinstance(e, FutureTimeoutError)
+                metrics.upstream_errors.inc(upstream=upstream, kind="timeout" if timed_out else "error")
+                error = e
+            except BaseException as e:
+                # Not an upstream failure (busy governor, bad input): give the probe slot back and re-raise
+                breaker.release()
+                if isinstance(e, UpstreamBusyError):
+                    metrics.upstream_errors.inc(upstream=upstream, kind="busy")
+                raise
+            else:
+                breaker.record_success()
+                return result
+
+            backoff = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+            if attempt + 1 >= attempts or time.monotonic() + backoff >= deadline_at:
+                break
+            time.sleep(backoff)
+
+        if isinstance(error, FutureTimeoutError):
+            raise UpstreamError(f"{upstream} did not answer within its deadline") from error
+        raise UpstreamError(f"{upstream} failed: {type(error).__name__}: {error}") from error
+
+    def stats(self):
+        return {name: breaker.stats() for name, breaker in self._breakers.items()}
+
+
+resilience = Resilience(cfg.UPSTREAM_POLICIES)
@@ -0,0 +1,164 @@
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+# MinHash signature of NUM_PERM values split into BANDS bands of NUM_PERM // BANDS rows: two texts
+# share a band (and are compared) with high probability once their Jaccard similarity is about 0.5 or more
+NUM_PERM = 64
+BANDS = 16
+_PRIME = (1 << 61) - 1
+_PERMUTATIONS = [
+    (int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % _PRIME or 1,
+     int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % _PRIME)
+    for i in range(NUM_PERM)
+]
+
+# Polite particles and fillers that do not change a question
+_PARTICLES = re.compile(r"(ครับ|คับ|ค่ะ|คะ|ค่า|จ้ะ|จ้า|จ๊ะ|นะ|น้า|หน่อย|ด้วย|เหรอ|หรอ)+$")
+_REPEATS = re.compile(r"(\D)\1{2,}")
+_DIGITS = re.compile(r"\d+")
+_THAI_DIGITS = str.maketrans("๐๑๒๓๔๕๖๗๘๙", "0123456789")
+
+
+def normalize(text):
+    """
+    Normalize a question for matching: NFC, lowercase, Thai digits as 0-9, repeated characters
+    ("มากกกก") collapsed, punctuation / spaces removed and trailing polite particles dropped
+    """
+    text = unicodedata.normalize("NFC", text).lower().translate(_THAI_DIGITS)
+    text = _REPEATS.sub(r"\1", text)
+    # Drop punctuation, symbols, spaces and control characters (keeps Thai vowel and tone marks)
+    text = "".join(ch for ch in text if unicodedata.category(ch)[0] not in "PSZC")
+    return _PARTICLES.sub("", text) or text
+
+
+class SemanticCache:
+    """
+    Cache คำตอบของ textqa สำหรับคำถามที่คล้ายกัน (ไม่ต้องตรงกันทุกตัวอักษร)
+
+    คำถามถูก normalize แล้วแตกเป็น shingles (character n-grams หรือคู่คำจาก pythainlp / thai_tokenizer) และทำ MinHash
+    ค้นหาคำถามที่น่าจะคล้ายด้วย LSH แล้วตรวจ Jaccard similarity จริงของ shingles ก่อนคืนคำตอบ
+    คำถามที่มีตัวเลขต่างกัน (เช่น "ราคา 100 บาท" / "ราคา 200 บาท") จะไม่ถือว่าเหมือนกัน
+    เก็บใน process ไม่เกิน max_entries รายการ (LRU) และหมดอายุตาม ttl
+    """
+
+    def __init__(self, threshold=0.8, ttl=24 * 60 * 60, max_entries=5000, ngram=3, tokenizer="char", lexicon=None):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.ngram = ngram
+        self.tokenizer = tokenizer
+        self.lexicon = lexicon
+        self._words = None
+        self._entries = OrderedDict()  # id -> (shingles, numbers, answer, expires_at, bands)
+        self._buckets = {}  # (band, hash of band) -> set of ids
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def matchable(self, text):
+        """
+        Whether text keeps at least one full shingle after normalize(); text that is only
+        emoji, punctuation or symbols ("???", "👍") normalizes to "" and would match any other
+        """
+        return len(normalize(text)) >= self.ngram
+
+    def shingles(self, text):
+        normalized = normalize(text)
+        if self.tokenizer in ("pythainlp", "local"):
+            words = [word for word in self._tokenize(normalized) if word.strip()]
+            units = [" ".join(words[i:i + 2]) for i in range(max(1, len(words) - 1))]
+        else:
+            n = min(self.ngram, len(normalized)) or 1
+            units = [normalized[i:i + n] for i in range(max(1, len(normalized) - n + 1))]
+        return frozenset(units), tuple(_DIGITS.findall(normalized))
+
+    def _tokenize(self, text):
+        if self.tokenizer == "pythainlp":
+            from pythainlp.tokenize import word_tokenize
+
+            return word_tokenize(text, engine="newmm")
+        # In-process maximal matching, without the remote fallback
+        if self._words is None:
+            from app.thai_tokenizer import ThaiTokenizer, load_trie
+
+            self._words = ThaiTokenizer(load_trie(self.lexicon))
+        return self._words.tokenize(text)
+
+    @staticmethod
+    def _bands(shingles):
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big") for s in shingles]
+        signature = [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+        rows = NUM_PERM // BANDS
+        return [(band, hash(tuple(signature[band * rows:(band + 1) * rows]))) for band in range(BANDS)]
+
+    def get(self, question):
+        """The stored answer of the most similar question above threshold, or None"""
+        if not self.matchable(question):
+            return None
+        shingles, numbers = self.shingles(question)
+        bands = self._bands(shingles)
+        now = time.monotonic()
+        with self._lock:
+            candidates = set()
+            for band in bands:
+                candidates |= self._buckets.get(band, set())
+            best, best_score = None, self.threshold
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if entry[3] <= now:
+                    self._remove(entry_id)
+                    continue
+                if entry[1] != numbers:
+                    continue
+                score = len(shingles & entry[0]) / len(shingles | entry[0])
+                if score >= best_score:
+                    best, best_score = entry_id, score
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            self.hits += 1
+            return self._entries[best][2]
+
+    def set(self, question, answer):
+        if not self.matchable(question):
+            return
+        shingles, numbers = self.shingles(question)
+        bands = self._bands(shingles)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (shingles, numbers, answer, time.monotonic() + self.ttl, bands)
+            for band in bands:
+                self._buckets.setdefault(band, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        for band in entry[4]:
+            ids = self._buckets.get(band)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self._buckets[band]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
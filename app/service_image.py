@@ -1,37 +1,84 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Request, Response
 
-from linebot import LineBotApi, WebhookHandler
+from linebot import WebhookHandler
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import MessageEvent, TextMessage, TextSendMessage, ImageMessage, ImageSendMessage
 
-from aift import setting
-from aift.multimodal import textqa
-
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import ExitStack
 from datetime import datetime
 
-from aift.image.detection import face_blur
-from aift.image.classification import chest_classification
-from aift.image.classification import violence_classification
-from aift.image.classification import nsfw
-from aift.image import super_resolution
-from aift.image.detection import handwritten
-
-
-
-from app.configs import Configs
-
-import requests
+from app import http_client, jobs, line_reply, metrics, singleflight
+from app.context import aift_module, get_configs, get_context
+from app.dispatcher import QueueFullError, WebhookDispatcher
+from app.resilience import resilience
+from app.image_cache import ImageResultCache
+from app.image_preprocess import preprocess_image
+from app.media import fetch_message_content
+from app.session_store import SessionStore
 
 router = APIRouter(tags=["Image"], prefix="/image")
 
-cfg = Configs()
+cfg = get_configs()
 
-setting.set_api_key(cfg.AIFORTHAI_APIKEY) # AIFORTHAI_APIKEY
-line_bot_api = LineBotApi(cfg.LINE_CHANNEL_ACCESS_TOKEN)  # CHANNEL_ACCESS_TOKEN
-handler = WebhookHandler(cfg.LINE_CHANNEL_SECRET)  # CHANNEL_SECRET
+# AIForThai image models (imported on first use)
+face_blur                       = aift_module("aift.image.detection.face_blur")
+chest_classification            = aift_module("aift.image.classification.chest_classification")
+violence_classification         = aift_module("aift.image.classification.violence_classification")
+nsfw                            = aift_module("aift.image.classification.nsfw")
+super_resolution                = aift_module("aift.image.super_resolution.super_resolution")
+handwritten                     = aift_module("aift.image.detection.handwritten")
 
-######### Dictionary to store user's previous text messages #####
-user_messages                   = {}
+handler = WebhookHandler(cfg.LINE_CHANNEL_SECRET)  # CHANNEL_SECRET
+dispatcher = WebhookDispatcher(
+    "image",
+    handler,
+    mode=cfg.WEBHOOK_DISPATCH_MODE,
+    workers=cfg.WEBHOOK_WORKERS,
+    queue_size=cfg.WEBHOOK_QUEUE_SIZE,
+)
+
+######### Image model of each menu number #####
+IMAGE_MODELS                    = {
+    '1': 'face_blur',
+    '2': 'chest_classification',
+    '3': 'violence_classification',
+    '4': 'nsfw',
+    '5': 'super_resolution',
+}
+
+# "all" selects every model, and "3,4" (or "3 4") several of them
+ALL_MODELS                      = 'all'
+MAX_REPLY_MESSAGES              = 5
+
+# Calls of the models of multi-model selections
+model_executor                  = ThreadPoolExecutor(max_workers=cfg.IMAGE_MULTI_WORKERS, thread_name_prefix="image-model")
+
+######### Cache of model results per image (result URLs expire upstream, so they are kept shorter) #####
+image_results                   = ImageResultCache(
+    mode=cfg.IMAGE_CACHE_MODE,
+    backend=cfg.IMAGE_CACHE_BACKEND,
+    path=cfg.IMAGE_CACHE_PATH,
+    max_entries=cfg.IMAGE_CACHE_SIZE,
+    ttls={
+        'face_blur': 3600,
+        'chest_classification': 7 * 24 * 3600,
+        'violence_classification': 7 * 24 * 3600,
+        'nsfw': 7 * 24 * 3600,
+        'super_resolution': 3600,
+    },
+)
+# Analyses of the same image (cache key) in flight at the same time share one upstream call
+image_flights                   = singleflight.Group("image_models")
+
+######### Session store for user's previous text messages (selected model) #####
+user_messages                   = SessionStore(
+    "image_sessions",
+    backend=cfg.SESSION_BACKEND,
+    path=cfg.SESSION_PATH,
+    ttl=cfg.SESSION_TTL,
+    max_entries=cfg.SESSION_MAX_ENTRIES,
+)
 
 @router.post("")
 async def image_demo(request: Request):
@@ -41,7 +88,7 @@ async def image_demo(request: Request):
     ฟังก์ชันนี้ทำหน้าที่:
     1. รับ HTTP POST Request จาก Line Webhook
     2. ตรวจสอบลายเซ็น (X-Line-Signature) เพื่อยืนยันความถูกต้องของข้อความ
-    3. ส่งข้อความไปยัง handler เพื่อประมวลผลอีเวนต์ที่ได้รับ
+    3. ส่งอีเวนต์เข้าคิวของ dispatcher แล้วตอบกลับทันที (worker จะเรียก handler เพื่อประมวลผลอีเวนต์)
     4. รองรับการประมวลผลข้อความ (TextMessage) และรูปภาพ (ImageMessage):
         - สำหรับข้อความ (TextMessage): ใช้ข้อความเพื่อเลือกโมเดล AI เช่น Face Blur, Chest X-Ray Classification, NSFW Detection เป็นต้น
         - สำหรับรูปภาพ (ImageMessage): ประมวลผลรูปภาพด้วยโมเดล AI ที่เลือกไว้ และส่งผลลัพธ์กลับไปยังผู้ใช้
@@ -49,11 +96,14 @@ async def image_demo(request: Request):
     signature = request.headers["X-Line-Signature"]
     body = await request.body()
     try:
-        handler.handle(body.decode("UTF-8"), signature)
+        await dispatcher.submit(body.decode("UTF-8"), signature)
     except InvalidSignatureError:
         print(
             "Invalid signature. Please check your channel access token or channel secret."
         )
+    except QueueFullError:
+        # Not acknowledged, so LINE redelivers the events that did not fit
+        return Response("Busy", status_code=503, headers={"Retry-After": "1"})
     return "OK"
 
 
@@ -69,75 +119,243 @@ def handle_text_message(event):
     result = f"{day:02}{month:02}{hour:02}{adjusted_minute:02}"
 
 
-    user_messages[event.source.user_id]         = event.message.text
+    user_messages.set(event.source.user_id, event.message.text)
 
-    text                        = "Welcome to AIFT-CV model demo, please type following number \n to select the model \n 1.face_blur \n 2.chestXray \n 3.Violent \n 4.NFSW \n 5.Super_resolution"
+    text                        = "Welcome to AIFT-CV model demo, please type following number \n to select the model \n 1.face_blur \n 2.chestXray \n 3.Violent \n 4.NFSW \n 5.Super_resolution \n (several numbers such as 3,4 or all run the models together)"
 
     # return text response
     send_message(event, text)
 
 @handler.add(MessageEvent, message=ImageMessage)
 def handle_image_message(event):
-    message_id = event.message.id
-    image_content = line_bot_api.get_message_content(message_id)
-
-    # Save the image locally and process it XXXs
-    with open("image.jpg", "wb") as f:
-        for chunk in image_content.iter_content():
-            f.write(chunk)
-
-    #### Extract previous text messages from user adasd###
+    #### Extract previous text messages from user ###
     user_id                 = event.source.user_id
     previous_text           = user_messages.get(user_id)
     previous_text           = str(previous_text)
 
-
-    if previous_text =='1':
-        result              = face_blur.analyze('image.jpg')
-        result_url          = result['URL']
-        send_image(event, result_url)
-    elif previous_text == '2':
-        result              = chest_classification.analyze('image.jpg', return_json=False)
-        result_text         = result[0]['result']
-        send_message(event, result_text)
-    elif previous_text == '3':
-        result              = violence_classification.analyze('image.jpg')
-        result_text         = result['objects'][0]['result']
-        send_message(event, result_text)
-    elif previous_text == '4':
-        result              = nsfw.analyze('image.jpg')
-        result_text         = result['objects'][0]['result']
-        send_message(event, result_text)
-    elif previous_text == '5':
-        result              = super_resolution.analyze('image.jpg')
-        result_url          = result['url']
-        send_image(event, result_url)
-        
-    # elif previous_text == '6':
-    #     result              = person_detection(cfg.AIFORTHAI_APIKEY,'image.jpg')
-    #     send_image(event, result)
-
-    else:
+    models = selected_models(previous_text)
+    if not models:
         send_message(event, 'Please type the number first')
+        return
+
+    # Download the image into a per-request buffer; a resent image is answered from the cache
+    original = fetch_message_content(
+        get_context().line_bot_api,
+        event.message.id,
+        chunk_size=cfg.MEDIA_CHUNK_SIZE,
+        spool_threshold=cfg.MEDIA_SPOOL_THRESHOLD,
+    )
+    if len(models) > 1:
+        with original:
+            results, pending = cached_results(models, original)
+            # Several models run as one background job (its worker downloads the image again) when
+            # one of the uncached models is offloaded; their results are pushed together
+            offloaded = next((model for model, _ in pending if model in cfg.JOBS_OFFLOAD), None)
+            if offloaded and jobs.offload(
+                event, "image_multi", {"models": models, "message_id": event.message.id}, offloaded
+            ):
+                return
+            if pending:
+                expected = [line_reply.expected_seconds(metrics.upstream_seconds, upstream=model) for model, _ in pending]
+                line_reply.begin(event, None if None in expected else max(expected))
+            results = analyze_models(models, original, results, pending)
+        send_results(event, results)
+        return
+
+    model = models[0]
+    with original:
+        key = image_results.key(model, original)
+        result = image_results.get(key)
+        if result is None:
+            # A slow model may run as a background job whose result is pushed (its worker downloads the image again)
+            if jobs.offload(event, "image_model", {"model": model, "message_id": event.message.id}, model):
+                return
+            line_reply.begin(event, line_reply.expected_seconds(metrics.upstream_seconds, upstream=model))
+            # The same image sent by many users at once is analyzed once
+            result = image_flights.do(key, analyze_original, model, original, key)
+
+    send_result(event, result)
+
+
+@jobs.job_queue.handler("image_model")
+def image_job(payload):
+    """Background job of one image model: {"model", "message_id"} -> the result message"""
+    model = payload["model"]
+    with fetch_message_content(
+        get_context().line_bot_api,
+        payload["message_id"],
+        chunk_size=cfg.MEDIA_CHUNK_SIZE,
+        spool_threshold=cfg.MEDIA_SPOOL_THRESHOLD,
+    ) as original:
+        key = image_results.key(model, original)
+        result = image_results.get(key)
+        if result is None:
+            result = image_flights.do(key, analyze_original, model, original, key)
+    return [result_message(result)]
+
+
+@jobs.job_queue.handler("image_multi")
+def image_multi_job(payload):
+    """Background job of several image models: {"models", "message_id"} -> the result messages"""
+    models = payload["models"]
+    with fetch_message_content(
+        get_context().line_bot_api,
+        payload["message_id"],
+        chunk_size=cfg.MEDIA_CHUNK_SIZE,
+        spool_threshold=cfg.MEDIA_SPOOL_THRESHOLD,
+    ) as original:
+        results, pending = cached_results(models, original)
+        results = analyze_models(models, original, results, pending)
+    return results_messages(results)
+
+
+def selected_models(text):
+    """Models of a menu selection ("3", "3,4", "3 4" or "all") in menu order, or [] when it is not one"""
+    text = text.strip().lower()
+    if text == ALL_MODELS:
+        return list(IMAGE_MODELS.values())
+    numbers = text.replace(',', ' ').split()
+    if not numbers or any(number not in IMAGE_MODELS for number in numbers):
+        return []
+    return [model for number, model in IMAGE_MODELS.items() if number in numbers]
+
+
+def cached_results(models, original):
+    """({model: result} of the models cached for this image, [(model, key)] of the others)"""
+    results = {}
+    pending = []
+    for model in models:
+        key = image_results.key(model, original)
+        result = image_results.get(key)
+        if result is None:
+            pending.append((model, key))
+        else:
+            results[model] = result
+    return results, pending
+
+
+def analyze_models(models, original, results, pending):
+    """
+    วิเคราะห์รูปเดียวด้วยหลายโมเดลพร้อมกัน (pending จาก cached_results) แต่ละโมเดลมีเวลาไม่เกิน
+    IMAGE_MODEL_DEADLINE วินาที โมเดลที่ช้าหรือผิดพลาดจะได้ผลเป็นข้อความแจ้ง โดยไม่ทำให้โมเดลอื่นต้องรอ
 
+    return {model: result} ตามลำดับของ models
+    """
+    results = dict(results)
+    futures = {}
+    # The shared buffer is read here, one model at a time; the upload of each model gets its own file
+    for model, key in pending:
+        with ExitStack() as files:
+            image, _ = preprocess_image(original, model)
+            metrics.payload_bytes.inc(image.size, route="image", kind="image_upload")
+            if image is not original:
+                files.enter_context(image)
+            image_path = files.enter_context(image.as_file(".jpg"))
+            future = model_executor.submit(
+                image_flights.do, key, analyze_path, model, image_path, key, metrics.current_route()
+            )
+            # A model may still be running (or queued) after the deadline: its file is
+            # deleted when its own call has finished or been cancelled, not before
+            future.add_done_callback(lambda _, files=files.pop_all(): files.close())
+            futures[model] = future
+    wait(futures.values(), timeout=cfg.IMAGE_MODEL_DEADLINE)
+
+    for model, future in futures.items():
+        if not future.done():
+            future.cancel()
+            results[model] = {"type": "text", "value": "timed out"}
+            continue
+        try:
+            results[model] = future.result()
+        except Exception as e:
+            print(f"[image] {model} failed: {type(e).__name__}: {e}")
+            results[model] = {"type": "text", "value": "failed"}
+    return {model: results[model] for model in models}
+
+
+def analyze_path(model, image_path, key, route):
+    metrics.set_route(route)
+    result = resilience.call(model, analyze_image, model, image_path, deadline=cfg.IMAGE_MODEL_DEADLINE)
+    image_results.set(key, model, result)
+    return result
+
+
+def analyze_original(model, original, key):
+    # Shrink it to what the selected model needs (aift analyzers need a file path, so it gets a private temp file)
+    image, _ = preprocess_image(original, model)
+    metrics.payload_bytes.inc(image.size, route="image", kind="image_upload")
+    with image, image.as_file(".jpg") as image_path:
+        result = resilience.call(model, analyze_image, model, image_path)
+    image_results.set(key, model, result)
+    return result
+
+
+def analyze_image(model, image_path):
+    """Run an aift image model and return {"type": "text" | "image", "value": result text or result URL}"""
+    if model == 'face_blur':
+        result              = face_blur.analyze(image_path)
+        return {"type": "image", "value": result['URL']}
+    elif model == 'chest_classification':
+        result              = chest_classification.analyze(image_path, return_json=False)
+        return {"type": "text", "value": result[0]['result']}
+    elif model == 'violence_classification':
+        result              = violence_classification.analyze(image_path)
+        return {"type": "text", "value": result['objects'][0]['result']}
+    elif model == 'nsfw':
+        result              = nsfw.analyze(image_path)
+        return {"type": "text", "value": result['objects'][0]['result']}
+    elif model == 'super_resolution':
+        result              = super_resolution.analyze(image_path)
+        return {"type": "image", "value": result['url']}
+
+    # elif model == 'person_detection':
+    #     result              = person_detection(cfg.AIFORTHAI_APIKEY, image_path)
+    #     return {"type": "image", "value": result}
+
+
+def send_result(event, result):
+    line_reply.reply(event, result_message(result))
+
+
+def result_message(result):
+    if result["type"] == "image":
+        return ImageSendMessage(original_content_url=result["value"], preview_image_url=result["value"])
+    return TextSendMessage(text=result["value"])
+
+
+def send_results(event, results):
+    line_reply.reply(event, results_messages(results))
+
+
+def results_messages(results):
+    """Messages of several models: the text results in one message, then the result images"""
+    lines = [f"{model}: {result['value']}" for model, result in results.items() if result["type"] == "text"]
+    images = [result["value"] for result in results.values() if result["type"] == "image"]
+    messages = [TextSendMessage(text="\n".join(lines))] if lines else []
+    messages += [
+        ImageSendMessage(original_content_url=url, preview_image_url=url)
+        for url in images[:MAX_REPLY_MESSAGES - len(messages)]
+    ]
+    return messages
 
 
 def echo(event):
-    line_bot_api.reply_message(
+    get_context().line_bot_api.reply_message(
         event.reply_token, TextSendMessage(text=event.message.text)
     )
 
 
 # function for sending message
 def send_message(event, message):
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=message))
+    line_reply.reply(event, TextSendMessage(text=message))
 
 
 ## function for sending result
 def send_image(event,image_url):
-     line_bot_api.reply_message(
-          event.reply_token,ImageSendMessage(original_content_url = image_url, preview_image_url = image_url)
-     )
+    line_reply.reply(
+        event,
+        ImageSendMessage(original_content_url = image_url, preview_image_url = image_url),
+    )
 
 
 ##### function for convert http into https ####
@@ -157,14 +375,18 @@ def convert_http_to_https(url):
     else:
         return url
 #### function for person detection api for aiforthai ####
-def person_detection(AIFORTHAI_APIKEY, image_dir):
+def person_detection(AIFORTHAI_APIKEY, image):
+    """image: image bytes, or the path of an image file"""
 
-    url             = "https://api.aiforthai.in.th/person/human_detect/"
-    files           = {'src_img':open(image_dir, 'rb')} ### input image dir here ###
+    url             = cfg.AIFORTHAI_BASE_URL + "/person/human_detect/"
     data            = {'json_export':'true','img_export':'true'}
     headers         = {'Apikey': AIFORTHAI_APIKEY}
 
-    response        = requests.post(url, files=files, headers=headers, data=data)
+    if isinstance(image, str):
+        with open(image, 'rb') as f:
+            image   = f.read()
+    files           = {'src_img':('image.jpg', image, 'image/jpeg')}
+    response        = http_client.post(url, files=files, headers=headers, data=data)
     response        = response.json()['human_img']
     response        = convert_http_to_https(response)
     return response
\ No newline at end of file
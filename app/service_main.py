@@ -1,23 +1,55 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Request, Response
 
-from linebot import LineBotApi, WebhookHandler
+from linebot import WebhookHandler
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import MessageEvent, TextMessage, TextSendMessage
 
-from aift import setting
-from aift.multimodal import textqa
-
-from datetime import datetime
-
-from app.configs import Configs
+from app import line_reply, metrics, singleflight
+from app.cache import caches
+from app.context import aift_module, get_configs, get_context
+from app.conversation import ConversationMemory
+from app.dispatcher import QueueFullError, WebhookDispatcher
+from app.resilience import resilience
+from app.semantic_cache import SemanticCache, normalize
 
 router = APIRouter(tags=["Main"], prefix="/message")
 
-cfg = Configs()
+cfg = get_configs()
+
+textqa = aift_module("aift.multimodal.textqa")
 
-setting.set_api_key(cfg.AIFORTHAI_APIKEY) # AIFORTHAI_APIKEY
-line_bot_api = LineBotApi(cfg.LINE_CHANNEL_ACCESS_TOKEN)  # CHANNEL_ACCESS_TOKEN
 handler = WebhookHandler(cfg.LINE_CHANNEL_SECRET)  # CHANNEL_SECRET
+dispatcher = WebhookDispatcher(
+    "message",
+    handler,
+    mode=cfg.WEBHOOK_DISPATCH_MODE,
+    workers=cfg.WEBHOOK_WORKERS,
+    queue_size=cfg.WEBHOOK_QUEUE_SIZE,
+)
+
+# Per-user conversation history sent as textqa context
+conversations = ConversationMemory(
+    max_turns=cfg.CHAT_MAX_TURNS,
+    context_chars=cfg.CHAT_CONTEXT_CHARS,
+    summary_chars=cfg.CHAT_SUMMARY_CHARS,
+    idle_ttl=cfg.CHAT_IDLE_TTL,
+)
+
+# Answers of single-turn questions, reused for similar questions
+answer_cache = None
+if cfg.SEMANTIC_CACHE_ENABLED:
+    answer_cache = SemanticCache(
+        threshold=cfg.SEMANTIC_CACHE_THRESHOLD,
+        ttl=cfg.SEMANTIC_CACHE_TTL,
+        max_entries=cfg.SEMANTIC_CACHE_SIZE,
+        ngram=cfg.SEMANTIC_CACHE_NGRAM,
+        tokenizer=cfg.SEMANTIC_CACHE_TOKENIZER,
+        lexicon=cfg.THAI_LEXICON_PATH or None,
+    )
+    caches["textqa_answers"] = answer_cache
+
+# First questions (no history) in flight at the same time share one textqa call, by normalized text
+textqa_flights = singleflight.Group("textqa")
 
 
 @router.post("")
@@ -28,49 +60,70 @@ async def multimodal_demo(request: Request):
     ฟังก์ชันนี้ทำหน้าที่:
     1. รับ HTTP POST Request จาก Line Webhook
     2. ตรวจสอบลายเซ็น (X-Line-Signature) เพื่อยืนยันความถูกต้องของข้อความ
-    3. ส่งข้อความไปยัง handler เพื่อประมวลผลอีเวนต์ที่ได้รับ
+    3. ส่งอีเวนต์เข้าคิวของ dispatcher แล้วตอบกลับทันที (worker จะเรียก handler เพื่อประมวลผลอีเวนต์)
     4. เมื่อได้รับข้อความ (MessageEvent) ที่เป็นข้อความ (TextMessage):
-        - สร้าง session id โดยใช้วัน, เดือน, ชั่วโมง, และนาทีที่ปรับให้ลงตัวกับเลข 10
+        - ใช้ session id และประวัติการสนทนาล่าสุดของผู้ใช้แต่ละคน (ตัดให้ไม่เกินงบ context) เป็น context
         - ส่งข้อความไปยัง API Text QA ของ AI FOR THAI (ซึ่งใช้ Pathumma LLM) เพื่อประมวลผล
         - ส่งข้อความตอบกลับ (response) กลับไปยังผู้ใช้ผ่าน Line Messaging API
     """
     signature = request.headers["X-Line-Signature"]
     body = await request.body()
     try:
-        handler.handle(body.decode("UTF-8"), signature)
+        await dispatcher.submit(body.decode("UTF-8"), signature)
     except InvalidSignatureError:
         print(
             "Invalid signature. Please check your channel access token or channel secret."
         )
+    except QueueFullError:
+        # Not acknowledged, so LINE redelivers the events that did not fit
+        return Response("Busy", status_code=503, headers={"Retry-After": "1"})
     return "OK"
 
 
 @handler.add(MessageEvent, message=TextMessage)
 def handle_text_message(event):
-    # session id
-    current_time = datetime.now()
-    # extract day, month, hour, and minute
-    day, month = current_time.day, current_time.month
-    hour, minute = current_time.hour, current_time.minute
-    # adjust the minute to the nearest lower number divisible by 10
-    adjusted_minute = minute - (minute % 10)
-    result = f"{day:02}{month:02}{hour:02}{adjusted_minute:02}"
-
-    # aiforthai multimodal chat
-    text = textqa.chat(
-        event.message.text, result + cfg.AIFORTHAI_APIKEY, temperature=0.6, context=""
-    )["response"]
+    # session id and recent history of this user, trimmed to the context budget
+    user_id = event.source.user_id
+    session_id, context = conversations.prepare(user_id)
+
+    # A first question (no history) may reuse the answer of a similar question
+    first_turn = conversations.is_empty(user_id)
+    # Text without a full shingle of words ("???", "👍") normalizes to almost nothing and
+    # would share one answer with every other such text, so it is never reused or coalesced
+    if answer_cache is not None:
+        matchable = answer_cache.matchable(event.message.text)
+    else:
+        matchable = normalize(event.message.text) != ""
+    single_turn = answer_cache is not None and first_turn and matchable
+    text = answer_cache.get(event.message.text) if single_turn else None
+    if text is None:
+        # aiforthai multimodal chat (loading animation / push fallback from its recent latency)
+        line_reply.begin(event, line_reply.expected_seconds(metrics.upstream_seconds, upstream="textqa"))
+        if first_turn and matchable:
+            # First questions asked at the same time (e.g. after a broadcast) share one call
+            text = textqa_flights.do(normalize(event.message.text), ask, event.message.text, session_id, context)
+        else:
+            text = ask(event.message.text, session_id, context)
+        if single_turn:
+            answer_cache.set(event.message.text, text)
+    conversations.add_turn(user_id, event.message.text, text)
 
     # return text response
     send_message(event, text)
 
 
+def ask(question, session_id, context):
+    return resilience.call(
+        "textqa", textqa.chat, question, session_id, temperature=0.6, context=context, return_json=False
+    )
+
+
 def echo(event):
-    line_bot_api.reply_message(
+    get_context().line_bot_api.reply_message(
         event.reply_token, TextSendMessage(text=event.message.text)
     )
 
 
 # function for sending message
 def send_message(event, message):
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=message))
+    line_reply.reply(event, TextSendMessage(text=message))
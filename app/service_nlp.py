@@ -1,48 +1,77 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 
-from linebot import LineBotApi, WebhookHandler
+from linebot import WebhookHandler
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import MessageEvent, TextMessage, TextSendMessage, ImageMessage, AudioSendMessage,AudioMessage
-from aift import setting
-from aift.multimodal import textqa
-from app.configs import Configs
+from app.audio_cache import AudioCache
+from app.audio_pipeline import SegmentedTranscriber
+from app.batch import BatchRunner, read_ndjson, to_ndjson
+from app.cache import caches, create_cache
+from app.commands import CommandRegistry
+from app.context import aift_module, get_configs, get_context
+from app.dispatcher import QueueFullError, WebhookDispatcher
+from app.resilience import UpstreamError, resilience
+from app.thai_tokenizer import ThaiTokenizer, load_trie
+from app.media import fetch_message_content
 from datetime import datetime
-
-# AIForThai import
-from aift.nlp import tokenizer # 1. Tokenizer
-from aift.nlp import ner # 1.1 TNER
-from aift.nlp.longan import sentence_tokenizer, tagger, token_tagger, tokenizer as logan_tokenizer # 1.2. Longan
-from aift.nlp import g2p # 2. G2P
-from aift.nlp import soundex # 3. Soundex
-from aift.nlp import similarity # 4. Word similarity
-from aift.nlp import text_cleansing # 5. Text cleasing
-from aift.nlp import tag # 6. Tag Suggestion
-from aift.nlp.translation import zh2th # 7.1. Chinese to Thai
-from aift.nlp.translation import th2zh # 7.2. Thai to Chinese
-from aift.nlp.translation import en2th # 7.3. English to Thai
-from aift.nlp.translation import th2en # 7.4. Thai to English
-from aift.nlp import sentiment # 8. Sentiment analysis
-from aift.nlp.alignment import en_alignment # 9.1. English-Thai Word Aligner
-from aift.nlp.alignment import zh_alignment # 9.2. Chinese-Thai Word Aligner
-from aift.speech import tts
-from aift.speech.stt import partii4, partii5
+from functools import lru_cache
 
 # For Partii STT
 import io
-import re
 import json
-import requests
+
+from app import http_client, jobs, line_reply, metrics, singleflight
 
 # For Vaja9
 import wave
 
 router = APIRouter(tags=["NLP"], prefix="/nlp")
 
-cfg = Configs()
+cfg = get_configs()
+
+# AIForThai import (each module is imported on first use, see AIFT_WARMUP)
+tokenizer = aift_module("aift.nlp.tokenizer") # 1. Tokenizer
+ner = aift_module("aift.nlp.ner") # 1.1 TNER
+sentence_tokenizer = aift_module("aift.nlp.longan.sentence_tokenizer") # 1.2. Longan
+tagger = aift_module("aift.nlp.longan.tagger")
+token_tagger = aift_module("aift.nlp.longan.token_tagger")
+logan_tokenizer = aift_module("aift.nlp.longan.tokenizer")
+g2p = aift_module("aift.nlp.g2p") # 2. G2P
+soundex = aift_module("aift.nlp.soundex") # 3. Soundex
+similarity = aift_module("aift.nlp.similarity") # 4. Word similarity
+text_cleansing = aift_module("aift.nlp.text_cleansing") # 5. Text cleasing
+tag = aift_module("aift.nlp.tag") # 6. Tag Suggestion
+zh2th = aift_module("aift.nlp.translation.zh2th") # 7.1. Chinese to Thai
+th2zh = aift_module("aift.nlp.translation.th2zh") # 7.2. Thai to Chinese
+en2th = aift_module("aift.nlp.translation.en2th") # 7.3. English to Thai
+th2en = aift_module("aift.nlp.translation.th2en") # 7.4. Thai to English
+sentiment = aift_module("aift.nlp.sentiment") # 8. Sentiment analysis
+en_alignment = aift_module("aift.nlp.alignment.en_alignment") # 9.1. English-Thai Word Aligner
+zh_alignment = aift_module("aift.nlp.alignment.zh_alignment") # 9.2. Chinese-Thai Word Aligner
+tts = aift_module("aift.speech.speech.tts")
+partii4 = aift_module("aift.speech.stt.partii4")
+partii5 = aift_module("aift.speech.stt.partii5")
 
-setting.set_api_key(cfg.AIFORTHAI_APIKEY) # AIFORTHAI_APIKEY
-line_bot_api = LineBotApi(cfg.LINE_CHANNEL_ACCESS_TOKEN)  # CHANNEL_ACCESS_TOKEN
 handler = WebhookHandler(cfg.LINE_CHANNEL_SECRET)  # CHANNEL_SECRET
+dispatcher = WebhookDispatcher(
+    "nlp",
+    handler,
+    mode=cfg.WEBHOOK_DISPATCH_MODE,
+    workers=cfg.WEBHOOK_WORKERS,
+    queue_size=cfg.WEBHOOK_QUEUE_SIZE,
+)
+nlp_cache = create_cache(
+    "nlp_results",
+    backend=cfg.NLP_CACHE_BACKEND,
+    path=cfg.NLP_CACHE_PATH,
+    max_entries=cfg.NLP_CACHE_SIZE,
+)
+
+# Synthesized audio is stored under DIR_FILE + TTS_CACHE_SUBDIR and served from /static
+TTS_CACHE_SUBDIR = "tts/"
+audio_cache = AudioCache(cfg.DIR_FILE + TTS_CACHE_SUBDIR, max_bytes=cfg.TTS_CACHE_MAX_BYTES)
+caches["tts_audio"] = audio_cache
 
 
 @router.post("")
@@ -53,7 +82,7 @@ async def nlp_demo(request: Request):
     ฟังก์ชันนี้ทำหน้าที่:
     1. รับ HTTP POST Request จาก Line Webhook
     2. ตรวจสอบลายเซ็น (X-Line-Signature) เพื่อยืนยันความถูกต้องของข้อความ
-    3. ส่งข้อความไปยัง handler เพื่อประมวลผลอีเวนต์ที่ได้รับ
+    3. ส่งอีเวนต์เข้าคิวของ dispatcher แล้วตอบกลับทันที (worker จะเรียก handler เพื่อประมวลผลอีเวนต์)
     4. รองรับการประมวลผลข้อความ (TextMessage) และเสียง (AudioMessage):
         - สำหรับข้อความ (TextMessage): ตรวจจับคำสั่ง NLP และเรียกใช้ฟังก์ชันที่เกี่ยวข้อง เช่น Tokenizer, Translation, Sentiment Analysis เป็นต้น
         - สำหรับเสียง (AudioMessage): แปลงเสียงเป็นข้อความด้วย AI FOR THAI Speech-to-Text (Partii) และส่งข้อความตอบกลับไปยังผู้ใช้
@@ -61,26 +90,62 @@ async def nlp_demo(request: Request):
     signature = request.headers["X-Line-Signature"]
     body = await request.body()
     try:
-        handler.handle(body.decode("UTF-8"), signature)
+        await dispatcher.submit(body.decode("UTF-8"), signature)
     except InvalidSignatureError:
         print(
             "Invalid signature. Please check your channel access token or channel secret."
         )
+    except QueueFullError:
+        # Not acknowledged, so LINE redelivers the events that did not fit
+        return Response("Busy", status_code=503, headers={"Retry-After": "1"})
     return "OK"
 
+@router.post("/batch")
+async def nlp_batch(request: Request):
+    """
+    Batch endpoint สำหรับรันคำสั่ง NLP กับข้อความจำนวนมาก (ไม่ผ่าน Line)
+
+    รับ JSON list ของ {"command": "#trexplus", "text": "..."} (หรือ {"items": [...]})
+    หรือ NDJSON (Content-Type: application/x-ndjson) หนึ่งรายการต่อบรรทัด
+    รันพร้อมกันตาม NLP_BATCH_CONCURRENCY / NLP_BATCH_ENGINE_CONCURRENCY
+    และส่งผลลัพธ์กลับเป็น NDJSON ตามลำดับของ input ทันทีที่แต่ละรายการเสร็จ
+    """
+    if "ndjson" in request.headers.get("content-type", ""):
+        items = read_ndjson(await request.body())
+    else:
+        try:
+            body = await request.json()
+        except ValueError:  # JSONDecodeError, or a body that is not UTF-8
+            raise HTTPException(status_code=400, detail="Body must be JSON (or NDJSON)")
+        items = body.get("items", []) if isinstance(body, dict) else body
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Items must be a list")
+    results = batch_runner.run(items)
+    return StreamingResponse(
+        (to_ndjson(result) async for result in results), media_type="application/x-ndjson"
+    )
+
+
 @handler.add(MessageEvent, message=AudioMessage)
 def handle_voice_message(event):
     # #14. SPEECH TO TEXT (Partii)
-    # Get the audio file from LINE
-    message_content = line_bot_api.get_message_content(event.message.id)
-    
-    # Save the audio content to a file (optional, for further processing)
-    with open("received_audio.wav", "wb") as f:
-        for chunk in message_content.iter_content():
-            f.write(chunk)
+    # Long transcriptions may run as a background job whose result is pushed
+    if jobs.offload(event, "transcribe", {"message_id": event.message.id}, "partii"):
+        return
 
-    # Call ParTii function  
-    text = callPartii("received_audio.wav")
+    # Get the audio file from LINE
+    # Stream it into a per-request buffer and send the bytes straight to ParTii
+    with fetch_message_content(
+        get_context().line_bot_api,
+        event.message.id,
+        chunk_size=cfg.MEDIA_CHUNK_SIZE,
+        spool_threshold=cfg.MEDIA_SPOOL_THRESHOLD,
+    ) as audio:
+        # Call ParTii function (loading animation / push fallback from its recent latency)
+        line_reply.begin(event, line_reply.expected_seconds(metrics.upstream_seconds, upstream="partii"))
+        metrics.payload_bytes.inc(audio.size, route="nlp", kind="audio_upload")
+        # Decoded and cut at silences, the segments are transcribed in parallel
+        text, _ = transcriber.transcribe(audio.getvalue())
 
     # Call partii4 or partii5 in Python package
     # result  = partii4.transcribe('received_audio.wav', return_json=True)
@@ -88,206 +153,355 @@ def handle_voice_message(event):
     send_message(event,str(text))
 
 
+######### NLP commands, dispatched by the leading "#command" of the message #####
+WEEK = 7 * 24 * 3600
+DAY = 24 * 3600
+
+# Identical commands in flight at the same time (e.g. after a broadcast) share one upstream call
+commands = CommandRegistry(cache=nlp_cache, resilience=resilience, singleflight=singleflight.Group("nlp_commands"))
+batch_runner = BatchRunner(
+    commands,
+    concurrency=cfg.NLP_BATCH_CONCURRENCY,
+    engine_concurrency=cfg.NLP_BATCH_ENGINE_CONCURRENCY,
+)
+
+
 @handler.add(MessageEvent, message=TextMessage)
 def handle_text_message(event):
     user_input = event.message.text.strip()
-    command_list = [
-        "#trexplus","#lexto", "#trex++", "#tner","#g2p", "#soundex","#thaiwordsim", "#wordapprox", 
-        "#textclean", "#tagsuggest", "#mtch2th", "#mtth2ch", "#mten2th", "#mtth2en", "#ssense", "#emonews",
-        "#thaimoji", "#cyberbully", "#longan_sentence", "#longan_tagger", "#longan_tokentag", "#longan_tokenizer",
-        "#en2th_aligner", "#ch2th_aligner","#tts", "#vajatts","#textsum"
-    ]
-
-    matched_command = None
-    for cmd in command_list:
-        if user_input.startswith(cmd):
-            matched_command = cmd
-            break
-
-    if matched_command:
-        content = user_input[len(matched_command):].strip()
-
-        if matched_command == "#trexplus":
-            result = tokenizer.tokenize(content, engine='trexplus', return_json=True)
-            send_message(event, str(result))
-
-        elif matched_command == "#lexto":
-            result = tokenizer.tokenize(content, engine='lexto', return_json=True)
-            send_message(event, str(result))
-        
-        elif matched_command == "#trex++":
-            result = tokenizer.tokenize(content, engine='trexplusplus', return_json=True)
-            send_message(event, str(list(zip(result['words'], result['tags']))))
-        
-        elif matched_command == "#tner":
-            result = ner.analyze(content, return_json=True)
-            send_message(event, str(list(zip(result['words'], result['POS'], result['tags']))))
-        
-        elif matched_command == "#longan_sentence":
-            result = sentence_tokenizer.tokenize(content)
-            send_message(event, str(result))
-        
-        elif matched_command == "#longan_tagger":
-            result = tagger.tag(content)
-            send_message(event, str(result))
-        
-        elif matched_command == "#longan_tokentag":
-            result = token_tagger.tokenize_tag(content)
-            send_message(event, str(result))
-        
-        elif matched_command == "#longan_tokenizer":
-            result = logan_tokenizer.tokenize(content)
-            send_message(event, str(result))
-        
-        elif matched_command == "#g2p":
-            result = g2p.analyze(content)['output']['result']
-            send_message(event, str(result))
-        
-        elif matched_command == "#textsum":
-            print("Create function for Text summarization")
-            # result = callTextSummarization(content)
-            # send_message(event, str(result))
-
-        elif matched_command == "#soundex":
-            matched = re.match(r"#soundex(?:_([a-zA-Z0-9]+))?(.*)", user_input)
-            if matched:
-                # Default model, model = personname, royin
-                model = matched.group(1) if matched.group(1) else "personname"  
-                content = matched.group(2).strip()
-
-                result = soundex.analyze(content, model=model)['words']
-                send_message(event, str(result))
-
-        elif matched_command.startswith("#thaiwordsim"):
-            matched = re.match(r"#thaiwordsim(?:_([a-zA-Z0-9]+))?(.*)", user_input)
-            if matched:
-                # default to thwiki,  model = thwiki, twitter
-                model = matched.group(1) if matched.group(1) else "thwiki"
-                content = matched.group(2).strip()
-                result = similarity.similarity(content, engine='thaiwordsim', model=model)
-                send_message(event, str(result))         
-
-        elif matched_command == "#wordapprox":
-            matched = re.match(r"#wordapprox(?:_([a-zA-Z0-9]+))?(.*)", user_input)
-            if matched:
-                # default to personname,  model = personname, royin, food
-                model = matched.group(1) if matched.group(1) else "personname"  
-                content = matched.group(2).strip()
-
-                result = similarity.similarity(content, engine='wordapprox', model=model, return_json=True)
-                send_message(event, str(result))
-
-        elif matched_command == "#textclean":
-            result = text_cleansing.clean(content)
-            send_message(event, str(result))
-        
-        elif matched_command == "#tagsuggest":
-            result = tag.analyze(content, numtag=5)
-            send_message(event, str(result))
-        
-        elif matched_command == "#mtch2th":
-            result = zh2th.translate(content, return_json=True)
-            # result = Chainess2Thai(content, "zh", "th")
-            send_message(event, str(result))
-
-        elif matched_command == "#mtth2ch":
-            result = th2zh.translate(content, return_json=True)
-            # result = Chainess2Thai(content, "th", "zh")
-            send_message(event, str(result))
-
-        elif matched_command == "#mten2th":
-            result = en2th.translate(content)
-            # result = translate_xiaofan(content, "en2th")
-            send_message(event, str(result))
-
-        elif matched_command == "#mtth2en":
-            result = th2en.translate(content)
-            # result = translate_xiaofan(content, "th2en")
-            send_message(event, str(result))
-
-        elif matched_command == "#ssense":
-            result = sentiment.analyze(content, engine='ssense')
-            send_message(event, str(result))
-        
-        elif matched_command == "#emonews":
-            result = sentiment.analyze(content, engine='emonews')
-            send_message(event, str(result))
-        
-        elif matched_command == "#thaimoji":
-            result = sentiment.analyze(content, engine='thaimoji')
-            send_message(event, str(result))
-        
-        elif matched_command == "#cyberbully":
-            result = sentiment.analyze(content, engine='cyberbully')
-            send_message(event, str(result))
-                
-        elif matched_command == "#en2th_aligner":
-            # # ตัวอย่างภาษาอังกฤษ-ไทย เช่น "I like to recommend my friends to Thai restaurants|ฉันชอบแนะนำเพื่อนไปร้านอาหารไทย"
-            contents = content.split('|') # รับข้อความจาก Line ในรูปแบบคู่ภาษาที่ต้องการจับคู่ ด้วยเครื่องหมาย "|"
-            result = en_alignment.analyze(contents[0], contents[1], return_json=True)
-            send_message(event, str(result))
-
-        elif matched_command == "#ch2th_aligner":
-            # # ตัวอย่างภาษาจีน-ไทย เช่น "我是10月10日从泰国来的。|ฉันมาจากประเทศไทยเมื่อวันที่ 10 เดือนตุลาคม"
-            contents = content.split('|') # รับข้อความจาก Line ในรูปแบบคู่ภาษาที่ต้องการจับคู่ ด้วยเครื่องหมาย "|"
-            result = zh_alignment.analyze(contents[0], contents[1], return_json=True)
-            send_message(event, str(result))
-        
-        elif matched_command == "#vajatts":
-            speaker = 0 #[0=เสียงผู้ชาย, 1=เสียงผู้หญิง, 2=เด็กผู้ชาย, 3=เด็กผู้หญิง]
-            tts.convert(event.message.text, cfg.DIR_FILE+cfg.WAV_FILE, speaker=speaker) 
-
-            audio_url = cfg.WAV_URL+cfg.DIR_FILE+cfg.WAV_FILE
-            audio_duration = get_wav_duration_in_ms(cfg.DIR_FILE+cfg.WAV_FILE)
-
-            audio_message = AudioSendMessage(
-                    original_content_url=audio_url,
-                    duration=audio_duration
-                )
-            send_audio_message(event, audio_message)   
-          
-        elif matched_command == "#tts":
-            speaker = 0
-            response = callVaja9(content, speaker)
-            # print(response.text)
-            if response.json()['msg'] == 'success':
-                download_and_play(response.json()['wav_url'])
-                audio_url = cfg.WAV_URL + cfg.DIR_FILE + cfg.WAV_FILE
-                # print(f'URL: {audio_url}') ## Check URL send to Line API
-                duration_ms = int(response.json()['durations'] * 1000)
-                audio_message = AudioSendMessage(
-                    original_content_url=audio_url,
-                    duration=duration_ms
-                )
-                send_audio_message(event, audio_message)
-            else:
-                send_message(event, "TTS failed")
-    else:
+
+    matched = commands.match(user_input)
+    if matched is None:
         # echo(event)
         send_message(event, "Service not found")
-     
+        return
+
+    command, model, content = matched
+    # A cached reply is sent at once; only a miss is run inline or queued as a background job
+    result = commands.cached(command, model, content)
+    if result is None:
+        if jobs.offload(event, "nlp_command", {"command": command.name, "model": model, "content": content}, command.name):
+            return
+        line_reply.begin(event, line_reply.expected_seconds(metrics.command_seconds, command=command.name))
+        result = commands.run(command, model, content, check_cache=False)
+    if isinstance(result, str):
+        send_message(event, result)
+    elif result is not None:
+        send_audio_message(event, result)
+
+
+@jobs.job_queue.handler("nlp_command")
+def command_job(payload):
+    """Background job of a command: {"command", "model", "content"} -> the reply message"""
+    command = commands.get(payload["command"])
+    if command is None:
+        raise ValueError(f"unknown command {payload['command']!r}")
+    result = commands.run(command, payload["model"], payload["content"])
+    if isinstance(result, str):
+        return [TextSendMessage(text=result)]
+    return [result] if result is not None else []
+
+
+@jobs.job_queue.handler("transcribe")
+def transcribe_job(payload):
+    """Background job of a voice message: {"message_id"} -> the transcript"""
+    with fetch_message_content(
+        get_context().line_bot_api,
+        payload["message_id"],
+        chunk_size=cfg.MEDIA_CHUNK_SIZE,
+        spool_threshold=cfg.MEDIA_SPOOL_THRESHOLD,
+    ) as audio:
+        text, _ = transcriber.transcribe(audio.getvalue())
+    return [TextSendMessage(text=str(text))]
+
+
+@commands.command("#trexplus", upstream="tokenizer", cache_ttl=WEEK)
+def cmd_trexplus(content, model):
+    result = tokenizer.tokenize(content, engine='trexplus', return_json=True)
+    return str(result)
+
+
+# Local word segmentation; "#tokenize_lexto" etc. select a remote engine instead
+REMOTE_TOKENIZERS = ("trexplus", "lexto", "trexplusplus")
+
+
+@commands.command("#tokenize", upstream="tokenizer", default_model="local", local=True)
+def cmd_tokenize(content, model):
+    if model == "local":
+        return str(local_tokenizer().tokenize(content))
+    if model not in REMOTE_TOKENIZERS:
+        return "Unknown tokenizer: " + model
+    return str(remote_tokenize(content, engine=model))
+
+
+def remote_tokenize(text, engine=None):
+    return resilience.call(
+        "tokenizer", tokenizer.tokenize, text, engine=engine or cfg.THAI_TOKENIZER_FALLBACK, return_json=False
+    )
+
+
+@lru_cache(maxsize=None)
+def local_tokenizer():
+    """ThaiTokenizer of THAI_LEXICON_PATH, built on first use (a large word list takes a moment to compile)"""
+    words = ThaiTokenizer(
+        load_trie(cfg.THAI_LEXICON_PATH or None),
+        fallback=remote_tokenize if cfg.THAI_TOKENIZER_FALLBACK else None,
+        min_confidence=cfg.THAI_TOKENIZER_MIN_CONFIDENCE,
+    )
+    print(f"[thai_tokenizer] lexicon loaded: {words.trie.memory_bytes()} bytes, {len(words.trie)} nodes")
+    return words
+
+
+@commands.command("#lexto", upstream="tokenizer", cache_ttl=WEEK)
+def cmd_lexto(content, model):
+    result = tokenizer.tokenize(content, engine='lexto', return_json=True)
+    return str(result)
+
+
+@commands.command("#trex++", upstream="tokenizer", cache_ttl=WEEK)
+def cmd_trexplusplus(content, model):
+    result = tokenizer.tokenize(content, engine='trexplusplus', return_json=True)
+    return str(list(zip(result['words'], result['tags'])))
+
+
+@commands.command("#tner", upstream="ner", cache_ttl=WEEK)
+def cmd_tner(content, model):
+    result = ner.analyze(content, return_json=True)
+    return str(list(zip(result['words'], result['POS'], result['tags'])))
+
+
+@commands.command("#longan_sentence", upstream="longan", cache_ttl=WEEK)
+def cmd_longan_sentence(content, model):
+    result = sentence_tokenizer.tokenize(content)
+    return str(result)
+
+
+@commands.command("#longan_tagger", upstream="longan", cache_ttl=WEEK)
+def cmd_longan_tagger(content, model):
+    result = tagger.tag(content)
+    return str(result)
+
+
+@commands.command("#longan_tokentag", upstream="longan", cache_ttl=WEEK)
+def cmd_longan_tokentag(content, model):
+    result = token_tagger.tokenize_tag(content)
+    return str(result)
+
+
+@commands.command("#longan_tokenizer", upstream="longan", cache_ttl=WEEK)
+def cmd_longan_tokenizer(content, model):
+    result = logan_tokenizer.tokenize(content)
+    return str(result)
+
+
+@commands.command("#g2p", upstream="g2p", cache_ttl=WEEK)
+def cmd_g2p(content, model):
+    result = g2p.analyze(content)['output']['result']
+    return str(result)
+
+
+@commands.command("#textsum")
+def cmd_textsum(content, model):
+    print("Create function for Text summarization")
+    # result = callTextSummarization(content)
+    # return str(result)
+
+
+# model = personname, royin
+@commands.command("#soundex", upstream="soundex", default_model="personname", cache_ttl=WEEK)
+def cmd_soundex(content, model):
+    result = soundex.analyze(content, model=model)['words']
+    return str(result)
+
+
+# model = thwiki, twitter
+@commands.command("#thaiwordsim", upstream="similarity", default_model="thwiki", cache_ttl=WEEK)
+def cmd_thaiwordsim(content, model):
+    result = similarity.similarity(content, engine='thaiwordsim', model=model)
+    return str(result)
+
+
+# model = personname, royin, food
+@commands.command("#wordapprox", upstream="similarity", default_model="personname", cache_ttl=WEEK)
+def cmd_wordapprox(content, model):
+    result = similarity.similarity(content, engine='wordapprox', model=model, return_json=True)
+    return str(result)
+
+
+@commands.command("#textclean", upstream="text_cleansing")
+def cmd_textclean(content, model):
+    result = text_cleansing.clean(content)
+    return str(result)
+
+
+@commands.command("#tagsuggest", upstream="tag")
+def cmd_tagsuggest(content, model):
+    result = tag.analyze(content, numtag=5)
+    return str(result)
+
+
+@commands.command("#mtch2th", upstream="translation", cache_ttl=DAY)
+def cmd_mtch2th(content, model):
+    result = zh2th.translate(content, return_json=True)
+    # result = Chainess2Thai(content, "zh", "th")
+    return str(result)
+
+
+@commands.command("#mtth2ch", upstream="translation", cache_ttl=DAY)
+def cmd_mtth2ch(content, model):
+    result = th2zh.translate(content, return_json=True)
+    # result = Chainess2Thai(content, "th", "zh")
+    return str(result)
+
+
+@commands.command("#mten2th", upstream="translation", cache_ttl=DAY)
+def cmd_mten2th(content, model):
+    result = en2th.translate(content)
+    # result = translate_xiaofan(content, "en2th")
+    return str(result)
+
+
+@commands.command("#mtth2en", upstream="translation", cache_ttl=DAY)
+def cmd_mtth2en(content, model):
+    result = th2en.translate(content)
+    # result = translate_xiaofan(content, "th2en")
+    return str(result)
+
+
+@commands.command("#ssense", upstream="sentiment")
+def cmd_ssense(content, model):
+    result = sentiment.analyze(content, engine='ssense')
+    return str(result)
+
+
+@commands.command("#emonews", upstream="sentiment")
+def cmd_emonews(content, model):
+    result = sentiment.analyze(content, engine='emonews')
+    return str(result)
+
+
+@commands.command("#thaimoji", upstream="sentiment")
+def cmd_thaimoji(content, model):
+    result = sentiment.analyze(content, engine='thaimoji')
+    return str(result)
+
+
+@commands.command("#cyberbully", upstream="sentiment")
+def cmd_cyberbully(content, model):
+    result = sentiment.analyze(content, engine='cyberbully')
+    return str(result)
+
+
+@commands.command("#en2th_aligner", upstream="alignment")
+def cmd_en2th_aligner(content, model):
+    # # ตัวอย่างภาษาอังกฤษ-ไทย เช่น "I like to recommend my friends to Thai restaurants|ฉันชอบแนะนำเพื่อนไปร้านอาหารไทย"
+    contents = content.split('|') # รับข้อความจาก Line ในรูปแบบคู่ภาษาที่ต้องการจับคู่ ด้วยเครื่องหมาย "|"
+    result = en_alignment.analyze(contents[0], contents[1], return_json=True)
+    return str(result)
+
+
+@commands.command("#ch2th_aligner", upstream="alignment")
+def cmd_ch2th_aligner(content, model):
+    # # ตัวอย่างภาษาจีน-ไทย เช่น "我是10月10日从泰国来的。|ฉันมาจากประเทศไทยเมื่อวันที่ 10 เดือนตุลาคม"
+    contents = content.split('|') # รับข้อความจาก Line ในรูปแบบคู่ภาษาที่ต้องการจับคู่ ด้วยเครื่องหมาย "|"
+    result = zh_alignment.analyze(contents[0], contents[1], return_json=True)
+    return str(result)
+
+
+def cached_vajatts(content, model):
+    return cached_audio(content, 0, "vajatts")
+
+
+@commands.command("#vajatts", upstream="tts", max_concurrency=4, lookup=cached_vajatts)
+def cmd_vajatts(content, model):
+    speaker = 0 #[0=เสียงผู้ชาย, 1=เสียงผู้หญิง, 2=เด็กผู้ชาย, 3=เด็กผู้หญิง]
+    return vajatts_audio(content, speaker)
+
+
+def cached_tts(content, model):
+    return cached_audio(content, 0, "vaja9")
+
+
+@commands.command("#tts", upstream="tts", max_concurrency=4, lookup=cached_tts)
+def cmd_tts(content, model):
+    speaker = 0
+    audio_message = vaja9_audio(content, speaker)
+    if audio_message is None:
+        return "TTS failed"
+    return audio_message
+
+
 def echo(event):
-    line_bot_api.reply_message(
+    get_context().line_bot_api.reply_message(
         event.reply_token, TextSendMessage(text=event.message.text)
     )
 
 
 # function for sending audio message
 def send_audio_message(event,audio_message):
-        line_bot_api.reply_message(
-            event.reply_token,
-            audio_message)
+    line_reply.reply(event, audio_message)
         
 # function for sending message
 def send_message(event, message):
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=message))
+    line_reply.reply(event, TextSendMessage(text=message))
+
+# Concurrent synthesis of the same (text, speaker) shares one upstream call
+tts_flights = singleflight.Group("tts")
+
+# Audio message of an already synthesized (text, speaker), or None
+def cached_audio(text, speaker, engine):
+    key = audio_cache.key(text, speaker, engine)
+    duration_ms = audio_cache.lookup(key, count_miss=False)
+    if duration_ms is None:
+        return None
+    return AudioSendMessage(original_content_url=audio_url(key), duration=duration_ms)
+
+# TTS with aift tts.convert, reusing the cached file of the same (text, speaker)
+def vajatts_audio(text, speaker):
+    key = audio_cache.key(text, speaker, "vajatts")
+    duration_ms = audio_cache.lookup(key)
+    if duration_ms is None:
+        duration_ms = tts_flights.do(key, synthesize_vajatts, key, text, speaker)
+    return AudioSendMessage(original_content_url=audio_url(key), duration=duration_ms)
+
+def synthesize_vajatts(key, text, speaker):
+    temp_path = audio_cache.temp_path(key)
+    try:
+        tts.convert(text, temp_path, speaker=speaker)
+        duration_ms = get_wav_duration_in_ms(temp_path)
+        audio_cache.store(key, temp_path, duration_ms)
+    finally:
+        audio_cache.discard(temp_path)
+    return duration_ms
+
+# TTS with Vaja9 API, reusing the cached file of the same (text, speaker); None when synthesis fails
+def vaja9_audio(text, speaker):
+    key = audio_cache.key(text, speaker, "vaja9")
+    duration_ms = audio_cache.lookup(key)
+    if duration_ms is None:
+        duration_ms = tts_flights.do(key, synthesize_vaja9, key, text, speaker)
+        if duration_ms is None:
+            return None
+    # print(f'URL: {audio_url(key)}') ## Check URL send to Line API
+    return AudioSendMessage(original_content_url=audio_url(key), duration=duration_ms)
+
+# Synthesize with Vaja9 into the cache and return the duration in ms; None when synthesis fails
+def synthesize_vaja9(key, text, speaker):
+    response = callVaja9(text, speaker)
+    # print(response.text)
+    if response.json()['msg'] != 'success':
+        return None
+    temp_path = audio_cache.temp_path(key)
+    try:
+        download_and_play(response.json()['wav_url'], temp_path)
+        duration_ms = int(response.json()['durations'] * 1000)
+        audio_cache.store(key, temp_path, duration_ms)
+    finally:
+        audio_cache.discard(temp_path)
+    return duration_ms
 
-def get_wav_duration_in_ms(file_path):
-    with wave.open(file_path, 'r') as wav_file:
-        frames = wav_file.getnframes()
-        rate = wav_file.getframerate()
-        duration = int(frames / rate) * 1000  # Convert seconds to milliseconds
-        return duration
+def audio_url(key):
+    return cfg.WAV_URL + cfg.DIR_FILE + TTS_CACHE_SUBDIR + audio_cache.filename(key)
 
 # Function call Vaja9
 def callVaja9(text, speaker):
@@ -295,46 +509,60 @@ def callVaja9(text, speaker):
 
     headers = {'Apikey':cfg.AIFORTHAI_APIKEY,"Content-Type": "application/json"}
     data = {'input_text':text,'speaker': speaker}
-    response = requests.post(url, json=data, headers=headers)
+    response = http_client.post(url, json=data, headers=headers)
     return response
 
 # Function for download audio file
-def download_and_play(sWav_url):
-    file_name = cfg.DIR_FILE+cfg.WAV_FILE
+def download_and_play(sWav_url, file_name=None):
+    file_name = file_name or cfg.DIR_FILE+cfg.WAV_FILE
     with open(file_name, 'wb') as a:
-        resp = requests.get(sWav_url,headers={'Apikey':cfg.AIFORTHAI_APIKEY})
+        resp = http_client.get(sWav_url,headers={'Apikey':cfg.AIFORTHAI_APIKEY})
         if resp.status_code == 200:
             a.write(resp.content)
         else:
             print(resp.reason)
-            exit(1)
+            raise UpstreamError(f"Vaja9 download failed: {resp.status_code} {resp.reason}")
     
 def get_wav_duration_in_ms(file_path):
     with wave.open(file_path, 'r') as wav_file:
         frames = wav_file.getnframes()
         rate = wav_file.getframerate()
-        duration = (frames / rate) * 1000  # Convert seconds to milliseconds
+        duration = int(frames / rate * 1000)  # Convert seconds to milliseconds
         return duration
 
-# Function for call Partii
-def callPartii(file):
+# Function for call Partii (file: audio bytes, or the path of an audio file)
+def callPartii(file, filename="received_audio.wav"):
     url = cfg.URL_PARTII
 
-    files = {'wavfile': (file, open(file, 'rb'), 'audio/wav')}
-
     headers = {'Apikey': cfg.AIFORTHAI_APIKEY,
             'Cache-Control': 'no-cache',
             'Connection': 'keep-alive',
             }
 
     param = {"outputlevel":"--uttlevel","outputformat":"--txt"}
-    response = requests.request("POST", url, headers=headers, files=files, data=param)
+    if isinstance(file, str):
+        filename = file
+        with open(file, 'rb') as f:
+            file = f.read()
+    files = {'wavfile': (filename, file, 'audio/wav')}
+    response = http_client.post(url, headers=headers, files=files, data=param)
     data = json.loads(response.text)
     return data['message']
 
+def transcribe_segment(wav, filename):
+    return resilience.call("partii", callPartii, wav, filename=filename)
+
+
+transcriber = SegmentedTranscriber(
+    transcribe_segment,
+    segment_seconds=cfg.STT_SEGMENT_SECONDS,
+    max_parallel=cfg.STT_MAX_PARALLEL,
+    min_silence_ms=cfg.STT_MIN_SILENCE_MS,
+)
+
 # Function call Chinese to Thai/ Thai to Chinese
 def Chainess2Thai(text, src, tar):
-    url = "https://api.aiforthai.in.th/xiaofan-zh-th"
+    url = cfg.AIFORTHAI_BASE_URL + "/xiaofan-zh-th"
  
     payload = json.dumps({
     "input": text,
@@ -343,14 +571,14 @@ def Chainess2Thai(text, src, tar):
     })
     headers = {'apikey': cfg.AIFORTHAI_APIKEY,'Content-Type': 'application/json'}
     
-    response = requests.request("POST", url, headers=headers, data=payload)
+    response = http_client.post(url, headers=headers, data=payload)
     # print(response.json())
     return response.json()['output']
 
 # Function call English to Thai/ Thai to English
 def translate_xiaofan(text, direction):
     # direction = 'en2th' or 'th2en'
-    url = f"https://api.aiforthai.in.th/xiaofan-en-th/{direction}"
+    url = f"{cfg.AIFORTHAI_BASE_URL}/xiaofan-en-th/{direction}"
 
     # Payload key changes based on direction
     if direction in ["en2th", "th2en"]:
@@ -363,7 +591,7 @@ def translate_xiaofan(text, direction):
         'Content-Type': 'application/json'
     }
 
-    response = requests.post(url, headers=headers, data=payload)
+    response = http_client.post(url, headers=headers, data=payload)
     return response.json()['translated_text']  # or response.text if you prefer raw
 
 
@@ -0,0 +1,28 @@
+from app.cache import create_cache
+
+
+class SessionStore:
+    """
+    Per-user session state ที่หมดอายุเองตาม ttl และจำกัดจำนวนผู้ใช้ด้วย max_entries (LRU)
+
+    backend = "memory" : เก็บใน process (ใช้กับ uvicorn worker เดียว)
+    backend = "sqlite" : เก็บในไฟล์ SQLite (WAL) ใช้ร่วมกันได้ระหว่าง --workers N บนเครื่องเดียวกัน
+    ค่าที่เก็บต้องแปลงเป็น JSON ได้
+    """
+
+    def __init__(self, name, backend="memory", path=None, ttl=1800, max_entries=10000):
+        self.ttl = ttl
+        self._cache = create_cache(name, backend=backend, path=path, max_entries=max_entries, ttl=ttl)
+
+    def get(self, user_id, default=None):
+        return self._cache.get(user_id, default)
+
+    def set(self, user_id, value):
+        # Every write restarts the TTL of the user's session
+        self._cache.set(user_id, value, ttl=self.ttl)
+
+    def delete(self, user_id):
+        self._cache.delete(user_id)
+
+    def stats(self):
+        return self._cache.stats()
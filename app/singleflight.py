@@ -0,0 +1,80 @@
+import threading
+
+from app import metrics
+
+# Groups by name, for /stats and the metrics
+groups = {}
+
+calls = metrics.Counter(
+    "singleflight_calls_total",
+    "Calls through a single-flight group: leader = ran the upstream call, coalesced = shared a call in flight",
+    ["group", "role"],
+)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class Group:
+    """
+    รวมการเรียก upstream ที่เหมือนกันซึ่งกำลังทำงานอยู่พร้อมกันให้เหลือครั้งเดียว (single-flight)
+
+    เมื่อข้อความเดียวกันถูกส่งมาจากผู้ใช้หลายคนพร้อมกัน (เช่น broadcast) cache ยังไม่มีคำตอบจนกว่า
+    การเรียกครั้งแรกจะเสร็จ คำขอที่มี key เดียวกันระหว่างนั้นจะรอผลของการเรียกที่กำลังทำงานอยู่
+    และได้ผลลัพธ์ (หรือ exception) เดียวกัน
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        groups[name] = self
+
+    def do(self, key, func, *args, **kwargs):
+        """Return func(*args, **kwargs), shared with the other callers of key while it runs"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                leader = True
+                self.leaders += 1
+            else:
+                flight.waiters += 1
+                leader = False
+                self.coalesced += 1
+
+        if not leader:
+            calls.inc(group=self.name, role="coalesced")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        calls.inc(group=self.name, role="leader")
+        try:
+            flight.result = func(*args, **kwargs)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._flights)
+            waiting = sum(flight.waiters for flight in self._flights.values())
+        return {"in_flight": in_flight, "waiting": waiting, "leaders": self.leaders, "coalesced": self.coalesced}
+
+
+def stats_all():
+    return {name: group.stats() for name, group in groups.items()}
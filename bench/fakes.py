@@ -0,0 +1,243 @@
+"""
+เซิร์ฟเวอร์จำลอง (stand-in) ของ LINE Messaging API และ AI FOR THAI สำหรับทดสอบโหลดบนเครื่อง
+
+    python -m bench.fakes line --port 9001 --latency 0.03
+    python -m bench.fakes aiforthai --port 9002 --latency 0.3 --jitter 0.2 --error-rate 0.02
+
+Latency and errors are set per path prefix with --profile, a JSON file such as
+{"default": {"latency": 0.2}, "/pathumma-chat": {"latency": 2.0, "jitter": 1.0, "error_rate": 0.05}}
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import random
+import struct
+import time
+import wave
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+BENCH_PREFIX = "/_bench"
+
+
+@dataclass
+class Profile:
+    """
+    latency      : base delay of every response (seconds)
+    jitter       : extra uniform delay in [0, jitter)
+    error_rate   : fraction of requests answered with HTTP 500
+    stall_rate   : fraction of requests that hang for stall_seconds (upstream timeouts)
+    """
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    stall_rate: float = 0.0
+    stall_seconds: float = 120.0
+
+    async def apply(self):
+        """Sleep for this profile; return an error response for a failed request, None otherwise"""
+        if self.stall_rate and random.random() < self.stall_rate:
+            await asyncio.sleep(self.stall_seconds)
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        if self.error_rate and random.random() < self.error_rate:
+            return JSONResponse({"message": "bench: injected error"}, status_code=500)
+        return None
+
+
+def load_profiles(args):
+    """{path prefix: Profile} from the command line defaults and the optional --profile file"""
+    default = {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "stall_rate": args.stall_rate,
+        "stall_seconds": args.stall_seconds,
+    }
+    overrides = {}
+    if args.profile:
+        with open(args.profile, encoding="utf-8") as f:
+            overrides = json.load(f)
+    default.update(overrides.pop("default", {}))
+    profiles = {"": Profile(**default)}
+    for prefix, values in overrides.items():
+        profiles[prefix] = Profile(**{**default, **values})
+    return profiles
+
+
+def add_profiles(app, profiles):
+    """Delay / fail every request except the /_bench control endpoints according to profiles"""
+    prefixes = sorted(profiles, key=len, reverse=True)
+
+    @app.middleware("http")
+    async def apply_profile(request: Request, call_next):
+        path = request.url.path
+        if not path.startswith(BENCH_PREFIX):
+            profile = profiles[next(p for p in prefixes if path.startswith(p))]
+            error = await profile.apply()
+            if error is not None:
+                return error
+        return await call_next(request)
+
+
+######### Media returned by the stand-ins #####
+def make_wav(seconds=4.0, rate=16000):
+    """16 kHz mono speech-like audio: 0.8 s tone bursts separated by 0.4 s of silence"""
+    frames = bytearray()
+    for i in range(int(seconds * rate)):
+        t = i / rate
+        voiced = t % 1.2 < 0.8
+        sample = int(8000 * math.sin(2 * math.pi * 220 * t)) if voiced else 0
+        frames += struct.pack("<h", sample)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+
+def make_jpeg(width=1280, height=960):
+    from PIL import Image
+
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+######### LINE Messaging API #####
+def create_line_app(profiles, audio_seconds=4.0):
+    """
+    Stand-in ของ LINE Messaging API (reply, push, loading animation และ message content)
+
+    บันทึกเวลาที่ได้รับ reply ของแต่ละ replyToken ไว้ให้ load generator คำนวณ latency
+    ตั้งแต่ส่ง webhook จนบอทตอบกลับ (GET /_bench/replies)
+    """
+    app = FastAPI()
+    app.state.replies = {}
+    app.state.pushes = []
+    app.state.jpeg = make_jpeg()
+    app.state.wav = make_wav(audio_seconds)
+    add_profiles(app, profiles)
+
+    @app.post("/v2/bot/message/reply")
+    async def reply(request: Request):
+        body = await request.json()
+        app.state.replies[body.get("replyToken", "")] = time.time()
+        return {}
+
+    @app.post("/v2/bot/message/push")
+    async def push(request: Request):
+        body = await request.json()
+        app.state.pushes.append({"to": body.get("to"), "at": time.time()})
+        return {}
+
+    @app.post("/v2/bot/chat/loading/start")
+    async def loading():
+        return JSONResponse({}, status_code=202)
+
+    @app.get("/v2/bot/message/{message_id}/content")
+    async def content(message_id: str):
+        # The message id is appended after the end of the media so every message has a different hash
+        if message_id.startswith("audio"):
+            return Response(app.state.wav + message_id.encode(), media_type="audio/wav")
+        return Response(app.state.jpeg + message_id.encode(), media_type="image/jpeg")
+
+    @app.get(BENCH_PREFIX + "/replies")
+    async def replies():
+        return {"replies": app.state.replies, "pushes": app.state.pushes}
+
+    @app.post(BENCH_PREFIX + "/reset")
+    async def reset():
+        app.state.replies.clear()
+        app.state.pushes.clear()
+        return {}
+
+    return app
+
+
+######### AI FOR THAI #####
+def aiforthai_payload(base_url):
+    """One response that carries the keys read from every AI FOR THAI endpoint the bot calls"""
+    words = ["สวัสดี", "ครับ"]
+    return {
+        "response": "คำตอบจากเซิร์ฟเวอร์จำลอง",
+        "content": "คำตอบจากเซิร์ฟเวอร์จำลอง",
+        "message": "ข้อความถอดเสียงจากเซิร์ฟเวอร์จำลอง",
+        "result": "|".join(words),
+        "tokens": words,
+        "words": words,
+        "tags": ["O", "O"],
+        "POS": ["VV", "PA"],
+        "output": {"result": "sa1 wat1 dii0"},
+        "translated_text": "hello",
+        "msg": "success",
+        "wav_url": base_url + BENCH_PREFIX[1:] + "/audio.wav",
+        "durations": 1.0,
+        "URL": base_url + BENCH_PREFIX[1:] + "/image.jpg",
+        "url": base_url + BENCH_PREFIX[1:] + "/image.jpg",
+        "objects": [{"result": "normal", "score": 0.99}],
+    }
+
+
+def create_aiforthai_app(profiles, audio_seconds=1.0):
+    """
+    Stand-in ของ AI FOR THAI: ทุก path ตอบด้วย JSON ที่มี key ครบตามที่บอทอ่าน
+    และให้ไฟล์เสียง/รูปภาพผลลัพธ์ที่ /_bench/audio.wav และ /_bench/image.jpg
+    """
+    app = FastAPI()
+    app.state.jpeg = make_jpeg(320, 240)
+    app.state.wav = make_wav(audio_seconds)
+    add_profiles(app, profiles)
+
+    @app.get(BENCH_PREFIX + "/audio.wav")
+    async def audio():
+        return Response(app.state.wav, media_type="audio/wav")
+
+    @app.get(BENCH_PREFIX + "/image.jpg")
+    async def image():
+        return Response(app.state.jpeg, media_type="image/jpeg")
+
+    @app.api_route("/{path:path}", methods=["GET", "POST"])
+    async def endpoint(request: Request, path: str):
+        await request.body()
+        return aiforthai_payload(str(request.base_url))
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-ins of LINE and AI FOR THAI for benchmarks")
+    parser.add_argument("service", choices=["line", "aiforthai"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None, help="default 9001 (line) / 9002 (aiforthai)")
+    parser.add_argument("--latency", type=float, default=None, help="seconds, default 0.03 (line) / 0.3 (aiforthai)")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--stall-rate", type=float, default=0.0)
+    parser.add_argument("--stall-seconds", type=float, default=120.0)
+    parser.add_argument("--profile", help="JSON file of per-path-prefix profiles")
+    parser.add_argument("--audio-seconds", type=float, default=None, help="length of the generated audio")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    if args.service == "line":
+        args.latency = 0.03 if args.latency is None else args.latency
+        app = create_line_app(load_profiles(args), audio_seconds=args.audio_seconds or 4.0)
+        port = args.port or 9001
+    else:
+        args.latency = 0.3 if args.latency is None else args.latency
+        app = create_aiforthai_app(load_profiles(args), audio_seconds=args.audio_seconds or 1.0)
+        port = args.port or 9002
+    uvicorn.run(app, host=args.host, port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
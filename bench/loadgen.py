@@ -0,0 +1,257 @@
+"""
+Load generator ของ webhook: ส่ง event ที่ลงลายเซ็น X-Line-Signature ถูกต้องไปยังบอท
+แล้วรายงาน throughput และ p50/p95/p99 ของแต่ละ route
+
+    python -m bench.loadgen --target http://127.0.0.1:8080 --line http://127.0.0.1:9001 \
+        --requests 1000 --concurrency 32 --mix message=1,nlp=3,image=1,audio=1
+
+ack   : time until the webhook answered (what LINE waits for)
+reply : time until the bot's reply reached the LINE stand-in (needs --line)
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import itertools
+import json
+import math
+import os
+import random
+import time
+
+import httpx
+
+from bench.run_app import BENCH_SECRET
+
+ROUTES = {
+    "message": "/message",
+    "nlp": "/nlp",
+    "audio": "/nlp",
+    "image": "/image",
+}
+
+NLP_COMMANDS = [
+    "#trexplus", "#lexto", "#trex++", "#tner", "#longan_tokenizer", "#g2p",
+    "#soundex", "#thaiwordsim", "#textclean", "#ssense", "#mtth2en",
+]
+
+TEXTS = [
+    "สวัสดีครับ วันนี้อากาศดีมาก",
+    "ฉันชอบกินข้าวผัดกะเพรา",
+    "ประเทศไทยมีจังหวัดทั้งหมดเจ็ดสิบเจ็ดจังหวัด",
+    "การประมวลผลภาษาธรรมชาติเป็นสาขาหนึ่งของปัญญาประดิษฐ์",
+    "ขอบคุณมากครับ",
+]
+
+IMAGE_MODELS = ["1", "2", "3", "4"]
+
+
+def sign(body, secret):
+    return base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+
+
+def message_event(user_id, reply_token, message):
+    return {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": user_id},
+        "webhookEventId": reply_token,
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": reply_token,
+        "message": message,
+    }
+
+
+def text_message(seq, text):
+    return {"type": "text", "id": f"text{seq}", "quoteToken": f"q{seq}", "text": text}
+
+
+def webhook_body(events):
+    return json.dumps({"destination": "bench", "events": events}, ensure_ascii=False).encode()
+
+
+def percentile(values, q):
+    """Nearest-rank q-th percentile (q in 0-100) of a sorted list: the ceil(q / 100 * n)-th smallest value"""
+    if not values:
+        return None
+    rank = math.ceil(q * len(values) / 100)
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+class LoadGenerator:
+    def __init__(self, args):
+        self.args = args
+        self.mix = parse_mix(args.mix)
+        self.users = [f"Ubench{i:04d}" for i in range(args.users)]
+        self.seq = itertools.count()
+        self.sent = {}  # reply token -> (route, sent_at)
+        self.results = []  # (route, status, ack seconds)
+
+    def event_for(self, route, seq):
+        user_id = random.choice(self.users)
+        token = f"bench-{route}-{seq}"
+        if route == "message":
+            message = text_message(seq, random.choice(TEXTS))
+        elif route == "nlp":
+            text = random.choice(TEXTS)
+            if self.args.unique_text:
+                text = f"{text} {seq}"
+            message = text_message(seq, f"{random.choice(NLP_COMMANDS)} {text}")
+        elif route == "audio":
+            message = {"type": "audio", "id": f"audio{seq}", "duration": 4000,
+                       "contentProvider": {"type": "line"}}
+        else:
+            message = {"type": "image", "id": f"image{seq}", "contentProvider": {"type": "line"}}
+        return token, message_event(user_id, token, message)
+
+    async def post(self, client, path, body):
+        return await client.post(
+            path,
+            content=body,
+            headers={"X-Line-Signature": sign(body, self.args.secret), "Content-Type": "application/json"},
+        )
+
+    async def warm_up(self, client):
+        """Select an image model for every user so that image events are analyzed"""
+        if "image" not in self.mix:
+            return
+        for user_id in self.users:
+            token = f"warmup-{user_id}"
+            event = message_event(user_id, token, text_message(token, random.choice(IMAGE_MODELS)))
+            await self.post(client, ROUTES["image"], webhook_body([event]))
+        await asyncio.sleep(self.args.warmup_wait)
+
+    async def worker(self, client, deadline):
+        routes, weights = zip(*self.mix.items())
+        while True:
+            seq = next(self.seq)
+            if seq >= self.args.requests or time.monotonic() >= deadline:
+                return
+            route = random.choices(routes, weights)[0]
+            token, event = self.event_for(route, seq)
+            body = webhook_body([event])
+            sent_at = time.time()
+            start = time.perf_counter()
+            try:
+                response = await self.post(client, ROUTES[route], body)
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            self.results.append((route, status, time.perf_counter() - start))
+            self.sent[token] = (route, sent_at)
+
+    async def collect_replies(self):
+        """Poll the LINE stand-in until every reply arrived or --drain seconds passed"""
+        if not self.args.line:
+            return {}
+        replies = {}
+        deadline = time.monotonic() + self.args.drain
+        async with httpx.AsyncClient(base_url=self.args.line) as client:
+            while True:
+                replies = (await client.get("/_bench/replies")).json()["replies"]
+                if all(token in replies for token in self.sent) or time.monotonic() >= deadline:
+                    return replies
+                await asyncio.sleep(0.5)
+
+    async def run(self):
+        limits = httpx.Limits(max_connections=self.args.concurrency)
+        async with httpx.AsyncClient(base_url=self.args.target, limits=limits, timeout=self.args.timeout) as client:
+            if self.args.line:
+                async with httpx.AsyncClient(base_url=self.args.line) as line:
+                    await line.post("/_bench/reset")
+            await self.warm_up(client)
+            started = time.monotonic()
+            deadline = started + (self.args.duration or float("inf"))
+            await asyncio.gather(*(self.worker(client, deadline) for _ in range(self.args.concurrency)))
+            elapsed = time.monotonic() - started
+        replies = await self.collect_replies()
+        return self.report(elapsed, replies)
+
+    def report(self, elapsed, replies):
+        routes = {}
+        for route, status, seconds in self.results:
+            stats = routes.setdefault(route, {"requests": 0, "errors": 0, "ack": [], "reply": [], "missing": 0})
+            stats["requests"] += 1
+            if status != 200:
+                stats["errors"] += 1
+            stats["ack"].append(seconds)
+        for token, (route, sent_at) in self.sent.items():
+            if not self.args.line:
+                break
+            if token in replies:
+                routes[route]["reply"].append(replies[token] - sent_at)
+            else:
+                routes[route]["missing"] += 1
+
+        report = {"elapsed": elapsed, "requests": len(self.results), "throughput": len(self.results) / elapsed, "routes": {}}
+        for route, stats in sorted(routes.items()):
+            entry = {
+                "requests": stats["requests"],
+                "errors": stats["errors"],
+                "throughput": stats["requests"] / elapsed,
+            }
+            for kind in ("ack", "reply"):
+                values = sorted(stats[kind])
+                if values:
+                    entry[kind] = {f"p{q}": percentile(values, q) for q in (50, 95, 99)}
+            if self.args.line:
+                entry["missing_replies"] = stats["missing"]
+            report["routes"][route] = entry
+        return report
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        route, _, weight = part.partition("=")
+        route = route.strip()
+        if route not in ROUTES:
+            raise SystemExit(f"Unknown route in --mix: {route} (use {', '.join(ROUTES)})")
+        mix[route] = float(weight or 1)
+    return mix
+
+
+def print_report(report):
+    def ms(values, q):
+        return f"{values[q] * 1000:8.1f}" if values else f"{'-':>8}"
+
+    print(f"{report['requests']} requests in {report['elapsed']:.1f}s = {report['throughput']:.1f} req/s")
+    header = f"{'route':<8} {'reqs':>6} {'err':>5} {'req/s':>7}"
+    header += "".join(f" {k + ' ' + q:>10}" for k in ("ack", "reply") for q in ("p50", "p95", "p99"))
+    print(header + f" {'missing':>8}")
+    for route, entry in report["routes"].items():
+        line = f"{route:<8} {entry['requests']:>6} {entry['errors']:>5} {entry['throughput']:>7.1f}"
+        for kind in ("ack", "reply"):
+            values = entry.get(kind)
+            line += "".join(f" {ms(values, q):>8}ms" for q in ("p50", "p95", "p99"))
+        print(line + f" {entry.get('missing_replies', '-'):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook load generator")
+    parser.add_argument("--target", default="http://127.0.0.1:8080", help="base URL of the bot")
+    parser.add_argument("--line", default=None, help="base URL of the LINE stand-in, to measure reply latency")
+    parser.add_argument("--secret", default=os.environ.get("LINE_CHANNEL_SECRET", BENCH_SECRET))
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--mix", default="message=1,nlp=3,image=1,audio=1")
+    parser.add_argument("--unique-text", action="store_true", help="make every NLP text unique (no cache hits)")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--warmup-wait", type=float, default=2.0)
+    parser.add_argument("--drain", type=float, default=60.0, help="seconds to wait for outstanding replies")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(LoadGenerator(args).run())
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+รัน app.main:app โดยชี้ LINE และ AI FOR THAI ไปที่เซิร์ฟเวอร์จำลองของ bench.fakes
+
+    python -m bench.run_app --port 8080 --line http://127.0.0.1:9001 --aiforthai http://127.0.0.1:9002
+
+Other settings (WEBHOOK_WORKERS, UPSTREAM_LIMITS, ...) are read from the environment / .env as usual.
+"""
+import argparse
+import os
+
+import requests
+
+AIFORTHAI_URL = "https://api.aiforthai.in.th"
+
+BENCH_SECRET = "bench-channel-secret"
+
+
+def redirect_aiforthai(target):
+    """
+    Send the aift package's requests to target: aift calls requests.post with
+    hardcoded https://api.aiforthai.in.th URLs, so AIFORTHAI_BASE_URL alone does not cover it
+    """
+    original = requests.Session.request
+
+    def request(self, method, url, *args, **kwargs):
+        if isinstance(url, str) and url.startswith(AIFORTHAI_URL):
+            url = target + url[len(AIFORTHAI_URL):]
+        return original(self, method, url, *args, **kwargs)
+
+    requests.Session.request = request
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bot against the bench stand-ins")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--line", default="http://127.0.0.1:9001")
+    parser.add_argument("--aiforthai", default="http://127.0.0.1:9002")
+    args = parser.parse_args()
+
+    os.environ["LINE_API_ENDPOINT"] = args.line
+    os.environ["LINE_API_DATA_ENDPOINT"] = args.line
+    os.environ["AIFORTHAI_BASE_URL"] = args.aiforthai
+    os.environ["URL_PARTII"] = args.aiforthai + "/partii-webapi"
+    os.environ["URL_VAJA"] = args.aiforthai + "/vaja9/synth_audiovisual"
+    os.environ.setdefault("AIFORTHAI_APIKEY", "bench")
+    os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "bench")
+    os.environ.setdefault("LINE_CHANNEL_SECRET", BENCH_SECRET)
+    os.environ.setdefault("WAV_URL", f"http://{args.host}:{args.port}/")
+    os.environ.setdefault("WAV_FILE", "bench.wav")
+    os.environ.setdefault("DIR_FILE", "static/")
+    redirect_aiforthai(args.aiforthai)
+
+    import uvicorn
+
+    # A single process: the redirect above is not inherited by uvicorn --workers
+    uvicorn.run("app.main:app", host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
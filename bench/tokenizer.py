@@ -0,0 +1,107 @@
+"""
+เปรียบเทียบ latency ของ tokenizer ใน process (app.thai_tokenizer) กับ tokenizer ของ AI FOR THAI
+
+    python -m bench.tokenizer --lexicon words.trie --engines trexplus,lexto --repeat 200
+    python -m bench.tokenizer --aiforthai http://127.0.0.1:9002   # against the bench.fakes stand-in
+
+Remote engines need AIFORTHAI_APIKEY (or --aiforthai). With a real key the
+agreement column is the F1 of the local word boundaries against each engine's.
+"""
+import argparse
+import os
+import time
+
+from bench.loadgen import TEXTS, percentile
+from bench.run_app import redirect_aiforthai
+
+SENTENCES = TEXTS + [
+    "สมัครเรียนได้ถึงวันไหนครับ",
+    "ค่าเทอมของมหาวิทยาลัยราคาเท่าไหร่",
+    "พรุ่งนี้ฝนจะตกที่กรุงเทพหรือเปล่า",
+    "ช่วยแปลประโยคนี้เป็นภาษาอังกฤษหน่อย",
+    "ร้านอาหารแถวนี้เปิดกี่โมงครับ",
+]
+
+
+def boundaries(words):
+    offsets, position = set(), 0
+    for word in words:
+        position += len(word)
+        offsets.add(position)
+    return offsets
+
+
+def agreement(local, remote):
+    """F1 of the word boundaries of local against remote (spaces ignored)"""
+    local = boundaries([word for word in local if word.strip()])
+    remote = boundaries([word for word in remote if word.strip()])
+    if not local or not remote:
+        return 0.0
+    common = len(local & remote)
+    precision, recall = common / len(local), common / len(remote)
+    return 2 * precision * recall / (precision + recall) if common else 0.0
+
+
+def measure(tokenize, repeat):
+    seconds, outputs = [], {}
+    for i in range(repeat):
+        sentence = SENTENCES[i % len(SENTENCES)]
+        started = time.perf_counter()
+        outputs[sentence] = tokenize(sentence)
+        seconds.append(time.perf_counter() - started)
+    return seconds, outputs
+
+
+def report(name, seconds, score=None):
+    seconds = sorted(seconds)
+    line = (
+        f"{name:<14} calls {len(seconds):>5}  mean {1000 * sum(seconds) / len(seconds):9.3f} ms"
+        f"  p50 {1000 * percentile(seconds, 50):9.3f} ms  p95 {1000 * percentile(seconds, 95):9.3f} ms"
+    )
+    if score is not None:
+        line += f"  agreement {score:.2f}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local vs remote Thai tokenizer latency")
+    parser.add_argument("--lexicon", default=None, help="word list or compiled .trie (default: the bundled list)")
+    parser.add_argument("--engines", default="trexplus,lexto", help="remote engines, empty for none")
+    parser.add_argument("--repeat", type=int, default=200, help="local calls (remote engines use --remote-repeat)")
+    parser.add_argument("--remote-repeat", type=int, default=20)
+    parser.add_argument("--aiforthai", default=None, help="send the remote calls to this base URL instead")
+    args = parser.parse_args()
+
+    from app.thai_tokenizer import ThaiTokenizer, load_trie
+
+    started = time.perf_counter()
+    trie = load_trie(args.lexicon)
+    print(f"lexicon        {len(trie)} nodes, {trie.memory_bytes()} bytes, loaded in {time.perf_counter() - started:.3f}s")
+    local = ThaiTokenizer(trie)
+    seconds, local_outputs = measure(local.tokenize, args.repeat)
+    report("local", seconds)
+
+    engines = [engine for engine in args.engines.split(",") if engine]
+    if not engines:
+        return
+    if args.aiforthai:
+        redirect_aiforthai(args.aiforthai)
+        os.environ.setdefault("AIFORTHAI_APIKEY", "bench")
+    from aift import setting
+    from aift.nlp.tokenizer import tokenize
+
+    setting.set_api_key(os.environ.get("AIFORTHAI_APIKEY", ""))
+    for engine in engines:
+        try:
+            seconds, outputs = measure(
+                lambda text: tokenize(text, engine=engine, return_json=False), args.remote_repeat
+            )
+        except Exception as e:
+            print(f"{engine:<14} failed: {type(e).__name__}: {e}")
+            continue
+        scores = [agreement(local_outputs[sentence], outputs[sentence]) for sentence in outputs]
+        report(engine, seconds, sum(scores) / len(scores))
+
+
+if __name__ == "__main__":
+    main()